@@ -8,11 +8,15 @@ try:
 except:
     pass
 
-if 'NGS_DEBUG' in _environ:
-    import OpenGL
+# OpenGL debugging (error checks after every GL call, collection of debug messages in gl.debug_log) is
+# expensive and only enabled with the environment variable NGSGUI_GL_DEBUG (or NGS_DEBUG). It must be
+# set before OpenGL is imported.
+import OpenGL
+if 'NGSGUI_GL_DEBUG' in _environ or 'NGS_DEBUG' in _environ:
     OpenGL.FULL_LOGGING = True
     _debug=True
 else:
+    OpenGL.ERROR_CHECKING = False
     _debug=False
 
 from .scenes import *
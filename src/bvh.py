@@ -0,0 +1,188 @@
+"""
+Bounding volume hierarchies over the elements of MeshData element blocks.
+
+The element data on the GPU is indexed by the element number within its block (also the solution
+values are), so elements can not be reordered. Instead, the leaves of the hierarchy are chunks of
+consecutive elements and inner nodes merge two neighbouring nodes of the level below. Culling the
+hierarchy against the view frustum and clipping planes gives compact ranges of possibly visible
+elements, which are then drawn instead of the whole block.
+"""
+
+import numpy, copy
+
+class ElementBVH:
+    # number of consecutive elements in one leaf
+    chunk_size = 256
+    # no hierarchy is built for smaller element blocks
+    min_elements = 10**4
+
+    def __init__(self, points, rows, nverts, curved=False):
+        """
+Parameters
+----------
+points : numpy array (nv, 3)
+  Vertex coordinates.
+rows : numpy array (nelements, element size)
+  Element data of the block, the vertex numbers are in columns 2..2+nverts.
+nverts : int
+  Number of vertices per element.
+curved : bool
+  Boxes of curved elements are enlarged, since the curved geometry is not contained in the box
+  of the vertices.
+"""
+        self.nelements = len(rows)
+        self.rows = rows
+        self.nverts = nverts
+        self.curved = curved
+        self._computeBoxes(points)
+
+    def refit(self, points):
+        """Hierarchy of the same elements with moved vertices points, only the boxes are computed again"""
+        bvh = copy.copy(self)
+        bvh._computeBoxes(points)
+        return bvh
+
+    def _computeBoxes(self, points):
+        cs = ElementBVH.chunk_size
+        rows, nverts, curved = self.rows, self.nverts, self.curved
+        nchunks = (self.nelements+cs-1)//cs
+        mins = numpy.empty((nchunks,3), dtype=numpy.float32)
+        maxs = numpy.empty((nchunks,3), dtype=numpy.float32)
+        # compute element boxes in batches to keep the memory usage bounded
+        batch = cs*4096
+        for start in range(0, self.nelements, batch):
+            p = points[rows[start:start+batch, 2:2+nverts]]
+            emin = p.min(axis=1)
+            emax = p.max(axis=1)
+            if curved:
+                margin = 0.25*(emax-emin).max(axis=1)[:,numpy.newaxis]
+                emin -= margin
+                emax += margin
+            chunks = numpy.arange(0, len(emin), cs)
+            first = start//cs
+            mins[first:first+len(chunks)] = numpy.minimum.reduceat(emin, chunks)
+            maxs[first:first+len(chunks)] = numpy.maximum.reduceat(emax, chunks)
+
+        # levels[0] are the leaves, levels[-1] is the root
+        self.levels = [(mins, maxs)]
+        while len(mins) > 1:
+            if len(mins) % 2:
+                mins = numpy.concatenate((mins, mins[-1:]))
+                maxs = numpy.concatenate((maxs, maxs[-1:]))
+            mins = numpy.minimum(mins[0::2], mins[1::2])
+            maxs = numpy.maximum(maxs[0::2], maxs[1::2])
+            self.levels.append((mins, maxs))
+
+    @staticmethod
+    def _intersects(mins, maxs, planes):
+        """Boxes which are (at least partially) in the positive half space of all planes"""
+        n = planes[:,:3]
+        # maximum of dot(n, x) over all corners x of each box
+        dist = numpy.maximum(mins[:,numpy.newaxis,:]*n, maxs[:,numpy.newaxis,:]*n).sum(axis=2) + planes[:,3]
+        return (dist >= 0).all(axis=1)
+
+    @staticmethod
+    def _hitByRay(mins, maxs, origin, inv_direction):
+        """Boxes which are hit by the ray origin + t*direction, t >= 0 (slab test)"""
+        t0 = (mins-origin)*inv_direction
+        t1 = (maxs-origin)*inv_direction
+        tmin = numpy.minimum(t0, t1).max(axis=1)
+        tmax = numpy.maximum(t0, t1).min(axis=1)
+        return tmax >= numpy.maximum(tmin, 0)
+
+    def visibleRanges(self, planes):
+        """Returns arrays (first, count) of element ranges which are possibly visible, i.e. intersect
+the positive half spaces dot(plane, (x,1)) >= 0 of all given planes"""
+        planes = numpy.asarray(planes, dtype=numpy.float32).reshape(-1,4)
+        return self._ranges(lambda mins, maxs: self._intersects(mins, maxs, planes))
+
+    def rayRanges(self, origin, direction):
+        """Returns arrays (first, count) of element ranges which are possibly hit by the ray
+origin + t*direction, t >= 0"""
+        origin = numpy.asarray(origin, dtype=numpy.float64)
+        direction = numpy.asarray(direction, dtype=numpy.float64)
+        # avoid divisions by zero for rays parallel to the coordinate planes
+        direction = numpy.where(numpy.abs(direction) < 1e-30, 1e-30, direction)
+        inv_direction = 1.0/direction
+        return self._ranges(lambda mins, maxs: self._hitByRay(mins, maxs, origin, inv_direction))
+
+    def _ranges(self, select):
+        """Traverses the hierarchy from the root, children of nodes accepted by select(mins, maxs) are
+tested on the next level. Returns the accepted leaves as element ranges (first, count)."""
+        nodes = numpy.zeros(1, dtype=numpy.int64)
+        for level, (mins, maxs) in enumerate(reversed(self.levels)):
+            if level > 0:
+                nodes = numpy.concatenate((2*nodes, 2*nodes+1))
+                nodes.sort()
+                nodes = nodes[nodes < len(mins)]
+            nodes = nodes[select(mins[nodes], maxs[nodes])]
+            if len(nodes) == 0:
+                empty = numpy.zeros(0, dtype=numpy.int32)
+                return empty, empty
+
+        # merge consecutive chunks to ranges of elements
+        cs = ElementBVH.chunk_size
+        breaks = numpy.flatnonzero(numpy.diff(nodes) != 1)
+        starts = nodes[numpy.concatenate(([0], breaks+1))]
+        ends = nodes[numpy.concatenate((breaks, [len(nodes)-1]))]+1
+        first = starts*cs
+        count = numpy.minimum(ends*cs, self.nelements) - first
+        return first.astype(numpy.int32), count.astype(numpy.int32)
+
+def maskRanges(mask):
+    """Ranges (first, count) of consecutive True entries of the boolean array mask"""
+    mask = numpy.concatenate(([False], numpy.asarray(mask, dtype=bool), [False]))
+    changes = numpy.flatnonzero(mask[1:] != mask[:-1])
+    first, end = changes[0::2], changes[1::2]
+    return first.astype(numpy.int32), (end-first).astype(numpy.int32)
+
+def mergeRanges(ranges, max_gap=0, max_ranges=None):
+    """Merges sorted, disjoint ranges (first, count) which are separated by at most max_gap entries,
+then the ranges with the smallest gaps until there are at most max_ranges"""
+    first, count = ranges
+    if len(first) < 2:
+        return first, count
+    end = first+count
+    gaps = first[1:]-end[:-1]
+    merge = gaps <= max_gap
+    if max_ranges is not None and len(first)-merge.sum() > max_ranges:
+        merge[numpy.argsort(gaps, kind='stable')[:len(first)-max(max_ranges,1)]] = True
+    keep = numpy.flatnonzero(~merge)
+    first = first[numpy.concatenate(([0], keep+1))]
+    end = end[numpy.concatenate((keep, [len(end)-1]))]
+    return first.astype(numpy.int32), (end-first).astype(numpy.int32)
+
+def intersectRanges(a, b):
+    """Intersection of two lists of sorted, disjoint element ranges (first, count)"""
+    s1, e1 = a[0], a[0]+a[1]
+    s2, e2 = b[0], b[0]+b[1]
+    # ranges of b overlapping range i of a are j0[i] <= j < j1[i]
+    j0 = numpy.searchsorted(e2, s1, side='right')
+    j1 = numpy.searchsorted(s2, e1, side='left')
+    n = numpy.maximum(j1-j0, 0)
+    i = numpy.repeat(numpy.arange(len(s1)), n)
+    j = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n)-n, n) + numpy.repeat(j0, n)
+    first = numpy.maximum(s1[i], s2[j])
+    end = numpy.minimum(e1[i], e2[j])
+    keep = end > first
+    return first[keep].astype(numpy.int32), (end-first)[keep].astype(numpy.int32)
+
+def intersectTriangles(a, b, c, origin, direction):
+    """Intersects the ray origin + t*direction with the triangles (a[i], b[i], c[i]) (Moeller-Trumbore).
+Returns arrays t, u, v, the hit points are a + u*(b-a) + v*(c-a). t is inf for triangles which are
+not hit (or hit at t < 0)."""
+    e1 = b-a
+    e2 = c-a
+    pvec = numpy.cross(direction, e2)
+    det = (e1*pvec).sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0/det
+        tvec = origin-a
+        u = (tvec*pvec).sum(axis=1)*inv_det
+        qvec = numpy.cross(tvec, e1)
+        v = (qvec*direction).sum(axis=1)*inv_det
+        t = (e2*qvec).sum(axis=1)*inv_det
+    eps = 1e-7
+    hit = (numpy.abs(det) > 1e-30) & (u >= -eps) & (v >= -eps) & (u+v <= 1+eps) & (t >= 0)
+    t = numpy.where(hit, t, numpy.inf)
+    return t, u, v
@@ -0,0 +1,200 @@
+"""Size capped caches with LRU eviction.
+
+FileCache entries are directories below the cache location (environment variable NGSGUI_CACHE_DIR,
+defaults to ~/.cache/ngsgui). The modification time of an entry is updated on every access and
+is used to evict the least recently used entries once the cache grows larger than its size cap.
+
+MemoryCache keeps python objects with a given size in memory.
+"""
+
+import os, shutil, tempfile, hashlib, logging, collections, threading
+
+logger = logging.getLogger(__name__)
+
+def getCacheLocation():
+    return os.environ.get("NGSGUI_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ngsgui"))
+
+def hashFile(filename, chunk_size=2**24):
+    """Content hash of a file, read in chunks to avoid loading large meshes at once"""
+    sha = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _directorySize(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return size
+
+class FileCache:
+    """On-disk cache with a size cap (in bytes) and LRU eviction.
+
+    Each key maps to one directory, which is filled by a user given function::
+
+        cache = FileCache("meshes", max_size=2*1024**3)
+        path = cache.lookup(key)
+        if path is None:
+            path = cache.store(key, lambda directory: write_files_to(directory))
+    """
+    def __init__(self, name, max_size, location=None):
+        self.directory = os.path.join(location or getCacheLocation(), name)
+        self.max_size = max_size
+        self.enabled = True
+
+    def _entry(self, key):
+        return os.path.join(self.directory, hashlib.sha1(str(key).encode()).hexdigest())
+
+    def lookup(self, key):
+        """Returns the directory of the cache entry for key or None if there is no such entry"""
+        if not self.enabled:
+            return None
+        path = self._entry(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, write):
+        """Creates the cache entry for key by calling write(directory) and returns its directory. The
+entry is written to a temporary directory first, so concurrent or aborted writes never leave
+incomplete entries behind. Returns None if the cache is disabled or the entry could not be written."""
+        if not self.enabled:
+            return None
+        path = self._entry(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp")
+        except OSError as e:
+            logger.warning("Cannot create cache entry in {}: {}".format(self.directory, e))
+            return None
+        try:
+            write(tmp)
+            os.rename(tmp, path)
+        except OSError as e:
+            # entry was written by somebody else in the meantime or disk is full
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                logger.warning("Cannot write cache entry {}: {}".format(path, e))
+                return None
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=path)
+        return path
+
+    def remove(self, key):
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def entries(self):
+        """List of (mtime, size, path) of all cache entries"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), _directorySize(path), path))
+            except OSError:
+                pass
+        return entries
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self, keep=None):
+        """Removes least recently used entries (except keep) until the cache is smaller than max_size"""
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            logger.debug("Evict cache entry {}".format(path))
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class MemoryCache:
+    """In-memory cache with a size cap (in bytes, the size of each entry is given when it is stored)
+and LRU eviction. Lookups and stores are thread safe. Hits, misses and evictions are counted, see
+getStats::
+
+        cache = MemoryCache(max_size=512*1024**2)
+        value = cache.lookup(key)
+        if value is None:
+            value = compute()
+            cache.store(key, value, size_of(value))
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.enabled = True
+        # key -> (value, size), the most recently used entry is the last one
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """Returns the value stored for key or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def store(self, key, value, size):
+        """Stores value for key and evicts least recently used entries until the cache is smaller than
+max_size. Values larger than max_size are not stored."""
+        if not self.enabled or size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                logger.debug("Evict cache entry {}".format(old_key))
+                self._size -= old_size
+                self.evictions += 1
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def size(self):
+        return self._size
+
+    def getStats(self):
+        """Dictionary with the number of 'hits', 'misses', 'evictions' and 'entries' and the 'size' and
+'max_size' in bytes"""
+        return { 'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+                 'entries' : len(self._entries), 'size' : self._size, 'max_size' : self.max_size }
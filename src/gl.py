@@ -4,13 +4,19 @@ from OpenGL import GL, constant
 from ngsgui import _debug
 
 from OpenGL.GL.ARB import debug_output
+from OpenGL.raw.GL._types import GLDEBUGPROC
 from OpenGL.extensions import alternate
-import ctypes, ngsolve, numpy, cmath, math
+import ctypes, ngsolve, numpy, cmath, math, collections, os
 
 import qtpy
 from qtpy import QtCore, QtGui
 
+import logging
+logger = logging.getLogger(__name__)
+
 from ngsgui.shader import locations as shaderpaths
+from ngsgui.cache import FileCache
+from ngsgui.profiler import profiler
 
 _DEVELOP=True
 
@@ -39,43 +45,203 @@ def get_constant(value, namespace):
     return value
 
 
-def check_debug_output():
-    if not _debug:
-        return
-    """Get the contents of the OpenGL debug log as a string."""
-
-    # details for the available log messages
-    msgmaxlen = GL.glGetInteger(debug_output.GL_MAX_DEBUG_MESSAGE_LENGTH_ARB)
-    msgcount = GL.glGetInteger(debug_output.GL_DEBUG_LOGGED_MESSAGES_ARB)
-
-    # ctypes arrays to receive the log data
-    msgsources = (ctypes.c_uint32 * msgcount)()
-    msgtypes = (ctypes.c_uint32 * msgcount)()
-    msgids = (ctypes.c_uint32 * msgcount)()
-    msgseverities = (ctypes.c_uint32 * msgcount)()
-    msglengths = (ctypes.c_uint32 * msgcount)()
-    msglog = (ctypes.c_char * (msgmaxlen * msgcount))()
-
-    glGetDebugMessageLog(msgcount, msgmaxlen, msgsources, msgtypes, msgids,
-                         msgseverities, msglengths, msglog)
-
-    offset = 0
-    logdata = zip(msgsources, msgtypes, msgids, msgseverities, msglengths)
-    for msgsource, msgtype, msgid, msgseverity, msglen in logdata:
-        msgtext = msglog.raw[offset:offset + msglen].decode("ASCII")
-        offset += msglen
-        msgsource = get_constant(msgsource, debug_output)
-        msgtype = get_constant(msgtype, debug_output)
-        msgseverity = get_constant(msgseverity, debug_output)
-        print("SOURCE: {0}\nTYPE: {1}\nID: {2}\nSEVERITY: {3}\n"
-               "MESSAGE: {4}".format(msgsource, msgtype, msgid,
-               msgseverity, msgtext))
+class GLDebugLog:
+    """Collects OpenGL debug messages in debug mode (environment variable NGSGUI_GL_DEBUG or command line
+flag --glDebug). Messages are stored with the python source location of the GL call that caused them
+(if the driver supports a debug callback) and counted in total and per frame. Each distinct message is
+logged only once."""
+    def __init__(self):
+        self.enabled = _debug
+        # (message id, source location) -> [count, source, type, severity, text]
+        self.messages = collections.OrderedDict()
+        # number of messages in the current and in the last complete frame
+        self.frame_count = 0
+        self.last_frame_count = 0
+        self._callback = None
+
+    def enable(self):
+        """Enables debug output in the current context. Without debug callback (OpenGL < 4.3), the log is
+read once per frame in beginFrame."""
+        glEnable(GL_DEBUG_OUTPUT)
+        if bool(glDebugMessageCallback):
+            # synchronous, such that the callback is called from the causing GL call
+            glEnable(GL_DEBUG_OUTPUT_SYNCHRONOUS)
+            self._callback = GLDEBUGPROC(self._onMessage)
+            glDebugMessageCallback(self._callback, None)
+
+    def _onMessage(self, source, type_, msgid, severity, length, text, user_param):
+        import traceback
+        location = None
+        for frame in reversed(traceback.extract_stack()[:-1]):
+            if not os.sep+'OpenGL'+os.sep in frame.filename:
+                location = '{}:{} ({})'.format(frame.filename, frame.lineno, frame.name)
+                break
+        self.add(source, type_, msgid, severity, text[:length].decode('ascii', 'ignore'), location)
+
+    def add(self, source, type_, msgid, severity, text, location=None):
+        key = (msgid, location)
+        if key not in self.messages:
+            source = get_constant(source, debug_output)
+            type_ = get_constant(type_, debug_output)
+            severity = get_constant(severity, debug_output)
+            logger.warning("OpenGL {} {} (id {}, {}) at {}: {}".format(source, type_, msgid, severity, location, text))
+            self.messages[key] = [0, source, type_, severity, text]
+        self.messages[key][0] += 1
+        self.frame_count += 1
+
+    def poll(self):
+        """Reads all messages from the debug log of the current context"""
+        # details for the available log messages
+        msgmaxlen = GL.glGetInteger(debug_output.GL_MAX_DEBUG_MESSAGE_LENGTH_ARB)
+        msgcount = GL.glGetInteger(debug_output.GL_DEBUG_LOGGED_MESSAGES_ARB)
+        if not msgcount:
+            return
+
+        # ctypes arrays to receive the log data
+        msgsources = (ctypes.c_uint32 * msgcount)()
+        msgtypes = (ctypes.c_uint32 * msgcount)()
+        msgids = (ctypes.c_uint32 * msgcount)()
+        msgseverities = (ctypes.c_uint32 * msgcount)()
+        msglengths = (ctypes.c_uint32 * msgcount)()
+        msglog = (ctypes.c_char * (msgmaxlen * msgcount))()
+
+        glGetDebugMessageLog(msgcount, msgmaxlen, msgsources, msgtypes, msgids,
+                             msgseverities, msglengths, msglog)
+
+        offset = 0
+        logdata = zip(msgsources, msgtypes, msgids, msgseverities, msglengths)
+        for msgsource, msgtype, msgid, msgseverity, msglen in logdata:
+            msgtext = msglog.raw[offset:offset + msglen].decode("ASCII")
+            offset += msglen
+            self.add(msgsource, msgtype, msgid, msgseverity, msgtext)
+
+    def beginFrame(self):
+        if self._callback is None:
+            self.poll()
+        self.last_frame_count = self.frame_count
+        self.frame_count = 0
+
+    def summary(self):
+        """Returns all collected messages with their counts as string, most frequent first"""
+        lines = []
+        for (msgid, location), (count, source, type_, severity, text) in sorted(self.messages.items(), key=lambda item: -item[1][0]):
+            lines.append("{:8d}x {} {} (id {}, {}) at {}: {}".format(count, source, type_, msgid, severity, location, text))
+        return "\n".join(lines)
+
+debug_log = GLDebugLog()
 
 class GLObject:
+    # number of existing OpenGL objects per class, to find leaks (see getGLObjectCounts)
+    _counts = collections.Counter()
+
     @property
     def id(self):
         return self._id
 
+    @property
+    def _id(self):
+        return self._gl_id
+
+    @_id.setter
+    def _id(self, value):
+        GLObject._counts[type(self).__name__] += 1
+        self._gl_id = value
+
+    def _deleted(self):
+        GLObject._counts[type(self).__name__] -= 1
+
+class GLState:
+    """Cache of the OpenGL state set in the render path: current program, textures bound to each texture
+unit, polygon mode/offset and enabled capabilities. Calls which would not change the state are skipped
+and counted. All state changes in gl.py and scenes.py go through the shared instance gl_state. The
+cache is reset at the beginning of each frame (see beginFrame), since Qt changes the state outside of
+it."""
+    def __init__(self):
+        # number of skipped GL calls in the current frame and in the last complete frame
+        self.skipped = 0
+        self.skipped_last_frame = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the cached state, the next calls set it unconditionally"""
+        self.program = None
+        self.active_texture = None
+        # (unit, target) -> texture id
+        self.textures = {}
+        self.polygon_mode = None
+        self.polygon_offset = None
+        self.caps = {}
+
+    def beginFrame(self):
+        self.skipped_last_frame = self.skipped
+        self.skipped = 0
+        self.reset()
+
+    def useProgram(self, pid):
+        if self.program == pid:
+            self.skipped += 1
+            return
+        glUseProgram(pid)
+        self.program = pid
+
+    def activeTexture(self, unit):
+        if self.active_texture == unit:
+            self.skipped += 1
+            return
+        glActiveTexture(GL_TEXTURE0+unit)
+        self.active_texture = unit
+
+    def bindTexture(self, unit, target, tid):
+        if self.textures.get((unit, target)) == tid:
+            # glActiveTexture and glBindTexture
+            self.skipped += 2
+            return
+        self.activeTexture(unit)
+        glBindTexture(target, tid)
+        self.textures[(unit, target)] = tid
+
+    def textureBound(self, target, tid):
+        """Called after the texture tid was bound to the active unit without the cache"""
+        if self.active_texture is None:
+            # unknown unit
+            self.textures = {}
+        else:
+            self.textures[(self.active_texture, target)] = tid
+
+    def enable(self, cap):
+        if self.caps.get(cap) is True:
+            self.skipped += 1
+            return
+        glEnable(cap)
+        self.caps[cap] = True
+
+    def disable(self, cap):
+        if self.caps.get(cap) is False:
+            self.skipped += 1
+            return
+        glDisable(cap)
+        self.caps[cap] = False
+
+    def polygonMode(self, mode):
+        if self.polygon_mode == mode:
+            self.skipped += 1
+            return
+        glPolygonMode(GL_FRONT_AND_BACK, mode)
+        self.polygon_mode = mode
+
+    def polygonOffset(self, factor, units):
+        if self.polygon_offset == (factor, units):
+            self.skipped += 1
+            return
+        glPolygonOffset(factor, units)
+        self.polygon_offset = (factor, units)
+
+gl_state = GLState()
+
+def getGLObjectCounts():
+    """Returns the number of existing OpenGL objects created by ngsgui per class name (e.g. 'Texture')"""
+    return dict(GLObject._counts)
+
 
 
 class Shader(GLObject):
@@ -93,6 +259,9 @@ class Shader(GLObject):
         for shaderpath in shader.locations:
             for incfile in glob.glob(os.path.join(shaderpath, '*.inc')):
                 Shader.includes[os.path.basename(incfile)] = open(incfile,'r').read()
+        # the expanded shader code depends on the includes
+        _expandShaderFile._cache.clear()
+        getProgramHash._cache.clear()
 
     def __init__(self, code=None, filename=None, shader_type=None, **replacements):
 
@@ -123,8 +292,13 @@ class Shader(GLObject):
 #                 numerated_shader_code += str(i)+":\t"+line+'\n'
             raise RuntimeError('Error when compiling ' + filename + ': '+glGetShaderInfoLog(self.id).decode())
 
-def readShaderFile(filename, defines):
-    import os
+def _expandShaderFile(filename):
+    """Code of the shader file with all includes expanded. Memoized, since reading and expanding the
+files is the main cost of computing program hashes (see getProgramHash)."""
+    cache = _expandShaderFile._cache
+    if filename in cache:
+        return cache[filename]
+
     for shaderpath in shaderpaths:
         fullpath = os.path.join(shaderpath, filename)
         if os.path.exists(fullpath):
@@ -142,21 +316,34 @@ def readShaderFile(filename, defines):
             raise Exception("Can't find include file " + token)
         code = code.replace('{include '+token+'}', Shader.includes[token])
 
+    cache[filename] = code
+    return code
+
+_expandShaderFile._cache = {}
+
+def readShaderFile(filename, defines):
+    code = _expandShaderFile(filename)
     pos = code.find('\n', code.find('version'))
     code = code[:pos+1] + defines + code[pos+1:]
 
     return code
 
 def getProgramHash(filenames, defines):
+    """Hash of the expanded shader code and the OpenGL driver, used as key of the on-disk program cache"""
     import hashlib
-    res = ""
-    h = hashlib.sha256()
-    h.update(glGetString(GL_VENDOR))
-    h.update(glGetString(GL_VERSION))
-    h.update(glGetString(GL_RENDERER))
-    for filename in sorted(filenames):
-        h.update((filename + readShaderFile(filename, defines)).encode('ascii'))
-    return h.hexdigest()
+    key = (tuple(sorted(filenames)), defines)
+    cache = getProgramHash._cache
+    if key not in cache:
+        h = hashlib.sha256()
+        h.update(glGetString(GL_VENDOR))
+        h.update(glGetString(GL_VERSION))
+        h.update(glGetString(GL_RENDERER))
+        for filename in key[0]:
+            h.update((filename + readShaderFile(filename, defines)).encode('ascii'))
+        cache[key] = h.hexdigest()
+    return cache[key]
+
+getProgramHash._cache = {}
 
 def compileProgram(filenames, defines, feedback=[]):
     shaders = []
@@ -166,26 +353,151 @@ def compileProgram(filenames, defines, feedback=[]):
 
     return Program(shaders, feedback=feedback)
 
+def _uniformMatrixSetter(function):
+    def set_matrix(loc, m):
+        # numpy arrays and ngsolve matrices are row major
+        if hasattr(m, 'NumPy'):
+            m = m.NumPy()
+        function(loc, 1, GL_TRUE, numpy.ascontiguousarray(m, dtype=numpy.float32))
+    return set_matrix
+
+# std140 layouts of the uniform blocks in utils.inc: name -> (binding point, size in bytes, members)
+# with members given as name -> (offset in bytes, kind)
+_uniform_block_layouts = {
+        'CameraBlock':   (0, 128, { 'P': (0, 'mat4'), 'MV': (64, 'mat4') }),
+        'LightBlock':    (1, 32,  { 'light.dir': (0, 'vec3'), 'light.ambient': (12, 'float'),
+                                    'light.diffuse': (16, 'float'), 'light.spec': (20, 'float'),
+                                    'light.shininess': (24, 'float') }),
+        'ColormapBlock': (2, 16,  { 'colormap.min': (0, 'float'), 'colormap.max': (4, 'float'),
+                                    'colormap.n': (8, 'int'), 'colormap.linear': (12, 'int') }),
+        'ClippingBlock': (3, 80,  { 'clipping_planes': (0, 'vec4[]'), 'clipping_sphere': (48, 'vec4'),
+                                    'clipping_plane_opacity': (64, 'float') }),
+        }
+_uniform_block_members = { name: block for block, (_,_,members) in _uniform_block_layouts.items() for name in members }
+# the first plane is also reported as 'clipping_planes[0]' by the driver
+_uniform_block_members['clipping_planes[0]'] = 'ClippingBlock'
+
+class UniformBuffer(GLObject):
+    """Uniform buffer object backing one of the std140 uniform blocks in utils.inc. Values are packed
+on the CPU and only uploaded if they changed since the last upload."""
+    def __init__(self, binding, size, members):
+        self.binding = binding
+        self.members = members
+        self.data = numpy.zeros(size, dtype=numpy.uint8)
+        self._uploaded = None
+        # (scene, frame) the values were last computed for, see getProgram
+        self.owner = None
+        self._id = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.id)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.id)
+
+    def set(self, name, value):
+        if name == 'clipping_planes[0]':
+            name = 'clipping_planes'
+        offset, kind = self.members[name]
+        if kind == 'mat4':
+            if hasattr(value, 'NumPy'):
+                value = value.NumPy()
+            # std140 matrices are column major
+            value = numpy.asarray(value, dtype=numpy.float32).reshape(4,4).T
+        elif kind == 'int':
+            value = numpy.array([int(value)], dtype=numpy.int32)
+        else:
+            value = numpy.asarray(value, dtype=numpy.float32)
+        value = numpy.ascontiguousarray(value).view(numpy.uint8).ravel()
+        self.data[offset:offset+len(value)] = value
+
+    def upload(self):
+        if self._uploaded is not None and numpy.array_equal(self._uploaded, self.data):
+            return
+        glBindBuffer(GL_UNIFORM_BUFFER, self.id)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, len(self.data), self.data)
+        self._uploaded = self.data.copy()
+
+def getUniformBuffer(block):
+    """Returns the (shared) UniformBuffer of the uniform block with given name"""
+    buffers = getUniformBuffer._buffers
+    if block not in buffers:
+        buffers[block] = UniformBuffer(*_uniform_block_layouts[block])
+    return buffers[block]
+
+getUniformBuffer._buffers = {}
+
+def _setUniformBlockMember(name, value):
+    """Used for uniforms which live in a uniform block, the value is set for all programs"""
+    buf = getUniformBuffer(_uniform_block_members[name])
+    buf.set(name, value)
+    buf.upload()
+    # values set by scenes (e.g. light.ambient for wireframes) must be replaced on the next getProgram
+    buf.owner = None
+
 class Program(GLObject):
     class Uniforms:
+        # functions to set a uniform of given type, arguments are the location and value
+        _setters = {
+                GL_SAMPLER_1D:        glUniform1i,
+                GL_SAMPLER_2D:        glUniform1i,
+                GL_SAMPLER_3D:        glUniform1i,
+                GL_INT_SAMPLER_3D:    glUniform1i,
+                GL_UNSIGNED_INT_SAMPLER_3D: glUniform1i,
+                GL_INT_SAMPLER_BUFFER:glUniform1i,
+                GL_SAMPLER_BUFFER:    glUniform1i,
+                GL_BOOL:              glUniform1i,
+                GL_BOOL_VEC2:         lambda loc, v: glUniform2i(loc, *v),
+                GL_BOOL_VEC3:         lambda loc, v: glUniform3i(loc, *v),
+                GL_BOOL_VEC4:         lambda loc, v: glUniform4i(loc, *v),
+                GL_INT:               glUniform1i,
+                GL_INT_VEC2:          lambda loc, v: glUniform2i(loc, *v),
+                GL_INT_VEC3:          lambda loc, v: glUniform3i(loc, *v),
+                GL_INT_VEC4:          lambda loc, v: glUniform4i(loc, *v),
+                GL_UNSIGNED_INT:      glUniform1ui,
+                GL_UNSIGNED_INT_VEC2: lambda loc, v: glUniform2ui(loc, *v),
+                GL_UNSIGNED_INT_VEC3: lambda loc, v: glUniform3ui(loc, *v),
+                GL_UNSIGNED_INT_VEC4: lambda loc, v: glUniform4ui(loc, *v),
+                GL_DOUBLE:            glUniform1d,
+                GL_FLOAT:             glUniform1f,
+                GL_FLOAT_VEC2:        lambda loc, v: glUniform2f(loc, *v),
+                GL_FLOAT_VEC3:        lambda loc, v: glUniform3f(loc, *v),
+                GL_FLOAT_VEC4:        lambda loc, v: glUniform4f(loc, *v),
+                GL_FLOAT_MAT2:        _uniformMatrixSetter(glUniformMatrix2fv),
+                GL_FLOAT_MAT3:        _uniformMatrixSetter(glUniformMatrix3fv),
+                GL_FLOAT_MAT4:        _uniformMatrixSetter(glUniformMatrix4fv),
+                }
+
         def __init__(self, pid):
             self.__dict__['id'] = pid
             num_uniforms = glGetProgramiv(self.id, GL_ACTIVE_UNIFORMS);
             uniforms = {}
+            setters = {}
             for i in range(num_uniforms):
                 name,dummy,type_ = glGetActiveUniform(self.id, i)
                 loc = glGetUniformLocation(self.id, name)
+                name = name.decode('ascii')
                 uniforms[name] = (loc,type_)
+                if loc == -1 and name in _uniform_block_members:
+                    setters[name] = lambda value, name=name: _setUniformBlockMember(name, value)
+                else:
+                    setters[name] = self._makeSetter(loc, type_)
             self.__dict__['uniforms'] = uniforms
+            # one function per uniform, created at link time to make set() cheap
+            self.__dict__['setters'] = setters
+
+        @staticmethod
+        def _makeSetter(loc, type_):
+            if type_ not in Program.Uniforms._setters:
+                def set_unknown(value):
+                    raise RuntimeError("Unknown type " + str(type_)+'=hex({})'.format(hex(type_)))
+                return set_unknown
+            function = Program.Uniforms._setters[type_]
+            return lambda value: function(loc, value)
 
         def check(self, name):
-            name = name.encode('ascii','ignore')
             if not name in self.uniforms:
                 raise RuntimeError("Unknown uniform name {}, allowed values:".format(name)+str(list(self.uniforms.keys())))
             return name
 
         def __contains__(self, name):
-            name = name.encode('ascii','ignore')
             return name in self.uniforms
 
         def __getitem__(self, name):
@@ -193,52 +505,15 @@ class Program(GLObject):
             return self.uniforms[name][0]
 
         def set(self, name, value):
-            try:
-                name = self.check(name)
-            except Exception as e:
+            """Sets the uniform name, vectors and matrices can be given as lists, numpy arrays or ngsolve
+vectors/matrices"""
+            setter = self.setters.get(name)
+            if setter is None:
                 if _DEVELOP:
                     # skip error on undefined (or optimized out) uniforms in develop mode
                     return
-                else:
-                    raise e
-
-            loc, type_ = self.uniforms[name]
-            convert_matrix = lambda m,size: (ctypes.c_float*(size**2))(*[m[j,i] for i in range(size) for j in range(size)])
-            functions = {
-                    GL_SAMPLER_1D:        lambda v: glUniform1i(loc, v),
-                    GL_SAMPLER_2D:        lambda v: glUniform1i(loc, v),
-                    GL_SAMPLER_3D:        lambda v: glUniform1i(loc,v),
-                    GL_INT_SAMPLER_3D:    lambda v: glUniform1i(loc,v),
-                    GL_UNSIGNED_INT_SAMPLER_3D: lambda v: glUniform1i(loc,v),
-                    GL_INT_SAMPLER_BUFFER:lambda v: glUniform1i(loc, v),
-                    GL_SAMPLER_BUFFER:    lambda v: glUniform1i(loc, v),
-                    GL_BOOL:              lambda v: glUniform1i(loc, v),
-                    GL_BOOL_VEC2:         lambda v: glUniform2i(loc, *v),
-                    GL_BOOL_VEC3:         lambda v: glUniform3i(loc, *v),
-                    GL_BOOL_VEC4:         lambda v: glUniform4i(loc, *v),
-                    GL_INT:               lambda v: glUniform1i(loc, v),
-                    GL_INT_VEC2:          lambda v: glUniform2i(loc, *v),
-                    GL_INT_VEC3:          lambda v: glUniform3i(loc, *v),
-                    GL_INT_VEC4:          lambda v: glUniform4i(loc, *v),
-                    GL_UNSIGNED_INT:      lambda v: glUniform1ui(loc, v),
-                    GL_UNSIGNED_INT_VEC2: lambda v: glUniform2ui(loc, *v),
-                    GL_UNSIGNED_INT_VEC3: lambda v: glUniform3ui(loc, *v),
-                    GL_UNSIGNED_INT_VEC4: lambda v: glUniform4ui(loc, *v),
-                    GL_DOUBLE:            lambda v: glUniform1d(loc, v),
-                    GL_FLOAT:             lambda v: glUniform1f(loc, v),
-                    GL_FLOAT_VEC2:        lambda v: glUniform2f(loc, *v),
-                    GL_FLOAT_VEC3:        lambda v: glUniform3f(loc, *v),
-                    GL_FLOAT_VEC4:        lambda v: glUniform4f(loc, *v),
-                    GL_FLOAT_MAT2:        lambda v: glUniformMatrix2fv(loc, 1, GL_FALSE, convert_matrix(v,2)),
-                    GL_FLOAT_MAT3:        lambda v: glUniformMatrix3fv(loc, 1, GL_FALSE, convert_matrix(v,3)),
-                    GL_FLOAT_MAT4:        lambda v: glUniformMatrix4fv(loc, 1, GL_FALSE, convert_matrix(v,4)),
-                    }
-            if type_ not in functions:
-                raise RuntimeError("Unknown type " + str(type_)+'=hex({})'.format(hex(type_)))
-            return functions[type_](value)
-
-        def __contains__(self, name):
-            return name.encode('ascii', 'ignore') in self.uniforms
+                self.check(name)
+            return setter(value)
 
     class Attributes:
         def __init__(self, pid):
@@ -355,6 +630,14 @@ class Program(GLObject):
         if glGetProgramiv(self.id, GL_LINK_STATUS) != GL_TRUE:
                 print(glGetProgramInfoLog(self.id))
 
+        # connect the uniform blocks to the binding points of the shared uniform buffers
+        self.uniform_blocks = set()
+        for block, (binding, _, _) in _uniform_block_layouts.items():
+            index = glGetUniformBlockIndex(self.id, block)
+            if index != GL_INVALID_INDEX:
+                glUniformBlockBinding(self.id, index, binding)
+                self.uniform_blocks.add(block)
+
         self.uniforms = Program.Uniforms(self.id)
         self.attributes = Program.Attributes(self.id)
 
@@ -366,8 +649,7 @@ class Program(GLObject):
         u = self.uniforms
         u.set(name+'.subdivision', 2**scene.getSubdivision()-1)
         u.set(name+'.is_complex', cf.is_complex)
-        glActiveTexture(GL_TEXTURE0+tex_base)
-        values['real'][elements.type, elements.curved].bind()
+        values['real'][elements.key].bind(tex_base)
         u.set(name+'.coefficients', tex_base)
         try:
             u.set(name+'.component', scene.getComponent() if cf.dim>1 else 0)
@@ -375,21 +657,17 @@ class Program(GLObject):
             pass
 
         if cf.is_complex:
-            glActiveTexture(GL_TEXTURE0+tex_base+1)
-            values['imag'][elements.type, elements.curved].bind()
+            values['imag'][elements.key].bind(tex_base+1)
             u.set(name+'.coefficients_imag', tex_base+1)
             u.set(name+'.complex_vis_function', scene._complex_eval_funcs[scene.getComplexEvalFunc()])
             w = cmath.exp(1j*scene.getComplexPhaseShift()/180.0*math.pi)
             u.set(name+'.complex_factor', [w.real, w.imag])
         if not cf.is_complex:
-            glActiveTexture(GL_TEXTURE0+tex_base+1)
             u.set(name+'.coefficients_imag', tex_base+1)
             u.set(name+'.complex_vis_function', 1)
             u.set(name+'.complex_factor', [0.0, 0.0])
 
 def getProgram(*shader_files, feedback=[], elements=None, params=None, scene=None, **define_flags):
-    import base64, zlib
-    check_debug_output()
     cache = getProgram._cache
 
     defines = '\n'
@@ -424,7 +702,8 @@ def getProgram(*shader_files, feedback=[], elements=None, params=None, scene=Non
     if scene and hasattr(scene,'getOrder'):
         define_flags['ORDER'] = scene.getOrder()
 
-    for d in define_flags:
+    # sorted, such that the same flags give the same program key independent of the argument order
+    for d in sorted(define_flags):
         flag = define_flags[d]
         if flag != None:
             if type(flag)==bool:
@@ -436,88 +715,142 @@ def getProgram(*shader_files, feedback=[], elements=None, params=None, scene=Non
     if key in cache:
         prog = cache[key]
     else:
-        # try to find on-disk cached shader
-        settings = getProgram._settings
-        h = getProgramHash(shader_files, defines=defines)
-        if str(h) == settings.value(key+'/hash'):
-            # load program from binary blob
-            enc = settings.value(key+'/program')
-            binary = numpy.frombuffer(base64.b64decode(enc), dtype=numpy.int8)
-            binary = zlib.decompress(binary)
-            format = int(settings.value(key+'/format'))
-            prog = Program(binary=(binary,format))
-            cache[key] = prog
-        else:
-            # no cached version - recompile shader 
+        prog = _loadProgram(shader_files, defines)
+        if prog is None:
+            # no cached version - recompile shader
             prog = compileProgram(shader_files, defines=defines, feedback=feedback)
-            cache[key] = prog
-
-            # get binary blob and store it on disk
-            size = glGetProgramiv( prog.id, GL_PROGRAM_BINARY_LENGTH )
-            if size:
-                result = numpy.zeros(size,dtype=numpy.uint8)
-                size2 = GLint()
-                format = GLenum()
-                res = glGetProgramBinary( prog.id, size, size2, format, result )
-                s = len(result)
-                result = zlib.compress(result)
-                enc = base64.b64encode(result).decode('ascii')
-                settings.setValue(key+'/format', str(format.value))
-                settings.setValue(key+'/program', enc)
-                settings.setValue(key+'/hash', str(h))
-
-    glUseProgram(prog.id)
+            _storeProgram(prog, shader_files, defines)
+        cache[key] = prog
+
+    gl_state.useProgram(prog.id)
     u = prog.uniforms
     if scene != None:
-        if 'P' in u:
-            u.set('P',scene.projection)
-        if 'MV' in u:
-            u.set('MV',scene.view*scene.model)
-        if 'light.diffuse' in u:
-            u.set('light.ambient', scene.getLightAmbient())
-            u.set('light.diffuse', scene.getLightDiffuse())
-            u.set('light.dir', [1.,3.,3.])
-            u.set('light.spec', scene.getLightSpecular())
-            u.set('light.shininess', scene.getLightShininess())
-        if do_clipping:
-            n = scene.getClippingNPlanes()
-            if 'clipping_planes[0]' in u:
-                planes = scene.getClippingPlanes()
-                planes = (ctypes.c_float*(4*n))(*planes)
-                glUniform4fv(u['clipping_planes[0]'], n, planes)
-            if 'clipping_sphere' in u:
-                sphere = [*scene.getClippingSphereCenter()] + [scene.getClippingSphereRadius()]
-                u.set('clipping_sphere', sphere)
-            if 'clipping_plane_opacity' in u:
-                u.set('clipping_plane_opacity', scene.getClippingPlaneOpacity())
-
-        if 'colormap.colors' in u and scene:
-            u.set('colormap.n', scene.getColormapSteps())
-            u.set('colormap.min', scene.getColormapMin())
-            u.set('colormap.max', scene.getColormapMax())
-            u.set('colormap.linear', scene.getColormapLinear())
-            glActiveTexture(GL_TEXTURE6)
-            scene.getColormapTex().bind()
-            u.set('colormap.colors', 6)
+        _updateUniformBlocks(scene, prog.uniform_blocks, do_clipping)
+        if 'colormap_colors' in u:
+            scene.getColormapTex().bind(6)
+            u.set('colormap_colors', 6)
 
     if elements != None:
         u.set('element_type', int(elements.type))
-        glActiveTexture(GL_TEXTURE0)
-        elements.tex_vertices.bind()
+        elements.tex_vertices.bind(0)
         u.set('mesh.vertices', 0)
         u.set('mesh.dim', elements.dim);
         u.set('mesh.offset', elements.offset);
         if elements.dim>0:
-            glActiveTexture(GL_TEXTURE1)
-            elements.tex.bind()
+            elements.tex.bind(1)
             u.set('mesh.elements', 1)
 
-    check_debug_output()
-
     return prog
 
 getProgram._cache = {}
-getProgram._settings = QtCore.QSettings('ngsolve','shaders')
+# on-disk cache of program binaries, one entry per program and driver (see getProgramHash)
+getProgram.disk_cache = FileCache("programs", max_size=256*1024**2)
+
+def beginFrame(settings):
+    """Called once per frame before any scene is rendered, with the global rendering settings. Sets the
+camera block, the other uniform blocks are then computed only once per scene in this frame."""
+    beginFrame.frame = (beginFrame.frame or 0) + 1
+    gl_state.beginFrame()
+    if debug_log.enabled:
+        debug_log.beginFrame()
+    camera = getUniformBuffer('CameraBlock')
+    camera.set('P', settings.projection)
+    camera.set('MV', settings.view*settings.model)
+    camera.upload()
+    camera.owner = beginFrame.frame
+
+# None if no frame was started (e.g. rendering in tests), then the blocks are updated on each getProgram
+beginFrame.frame = None
+
+def _updateUniformBlocks(scene, blocks, clipping):
+    """Sets the values of scene in the uniform blocks used by a program"""
+    frame = beginFrame.frame
+    def getBuffer(block, owner):
+        buf = getUniformBuffer(block)
+        if frame is not None and buf.owner == owner:
+            # already set in this frame
+            return None
+        buf.owner = owner
+        return buf
+
+    # the camera is the same for all scenes
+    if 'CameraBlock' in blocks:
+        buf = getBuffer('CameraBlock', frame)
+        if buf:
+            buf.set('P', scene.projection)
+            buf.set('MV', scene.view*scene.model)
+            buf.upload()
+
+    owner = (id(scene), frame)
+    if 'LightBlock' in blocks:
+        buf = getBuffer('LightBlock', owner)
+        if buf:
+            buf.set('light.dir', [1.,3.,3.])
+            buf.set('light.ambient', scene.getLightAmbient())
+            buf.set('light.diffuse', scene.getLightDiffuse())
+            buf.set('light.spec', scene.getLightSpecular())
+            buf.set('light.shininess', scene.getLightShininess())
+            buf.upload()
+
+    if 'ColormapBlock' in blocks:
+        buf = getBuffer('ColormapBlock', owner)
+        if buf:
+            buf.set('colormap.min', scene.getColormapMin())
+            buf.set('colormap.max', scene.getColormapMax())
+            buf.set('colormap.n', scene.getColormapSteps())
+            buf.set('colormap.linear', scene.getColormapLinear())
+            buf.upload()
+
+    if clipping and 'ClippingBlock' in blocks:
+        buf = getBuffer('ClippingBlock', owner)
+        if buf:
+            planes = numpy.zeros(12, dtype=numpy.float32)
+            p = scene.getClippingPlanes()
+            planes[:len(p)] = p
+            buf.set('clipping_planes', planes)
+            buf.set('clipping_sphere', [*scene.getClippingSphereCenter()] + [scene.getClippingSphereRadius()])
+            opacity = scene.getClippingPlaneOpacity() if hasattr(scene, 'getClippingPlaneOpacity') else 1.0
+            buf.set('clipping_plane_opacity', opacity)
+            buf.upload()
+
+def _loadProgram(shader_files, defines):
+    """Loads the program binary from the disk cache, returns None if there is no (usable) entry"""
+    disk_cache = getProgram.disk_cache
+    key = getProgramHash(shader_files, defines)
+    path = disk_cache.lookup(key)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, 'format')) as f:
+            format = int(f.read())
+        binary = numpy.fromfile(os.path.join(path, 'program'), dtype=numpy.uint8)
+    except (OSError, ValueError):
+        disk_cache.remove(key)
+        return None
+    prog = Program(binary=(binary,format))
+    if glGetProgramiv(prog.id, GL_LINK_STATUS) != GL_TRUE:
+        # the driver rejected the binary
+        disk_cache.remove(key)
+        glDeleteProgram(prog.id)
+        prog._deleted()
+        return None
+    return prog
+
+def _storeProgram(prog, shader_files, defines):
+    """Stores the binary of the linked program in the disk cache"""
+    size = glGetProgramiv( prog.id, GL_PROGRAM_BINARY_LENGTH )
+    if not size:
+        return
+    binary = numpy.zeros(size,dtype=numpy.uint8)
+    size2 = GLint()
+    format = GLenum()
+    glGetProgramBinary( prog.id, size, size2, format, binary )
+
+    def write(directory):
+        binary[:size2.value].tofile(os.path.join(directory, 'program'))
+        with open(os.path.join(directory, 'format'), 'w') as f:
+            f.write(str(format.value))
+    getProgram.disk_cache.store(getProgramHash(shader_files, defines), write)
 
 class VertexArray(GLObject):
     def __init__(self):
@@ -551,6 +884,21 @@ class ArrayBuffer(GLObject):
         self.bind()
         glBufferData(self._type, size if size else len(data) * ctypes.sizeof(ctypes.c_float), data, self._usage)
 
+class FeedbackBuffer(ArrayBuffer):
+    """Buffer for the output of transform feedback passes, which is allocated lazily and grows on
+demand"""
+    def __init__(self):
+        super().__init__(GL_ARRAY_BUFFER, GL_DYNAMIC_COPY)
+        self.size = 0
+
+    def reserve(self, size):
+        """Makes sure the buffer has at least size bytes, the content is lost if it is reallocated"""
+        if size > self.size:
+            # grow by at least 50% to avoid frequent reallocations
+            self.size = max(int(size), self.size*3//2)
+            self.bind()
+            glBufferData(self._type, self.size, ctypes.c_void_p(), self._usage)
+
 class Texture(GLObject):
     def __init__(self, buffer_type, format, format2=None):
         if isinstance(format, ngsolve.CoefficientFunction):
@@ -574,8 +922,14 @@ class Texture(GLObject):
             glTexParameteri( self._type, GL_TEXTURE_MIN_FILTER, GL_NEAREST )
 
 
-    def bind(self):
+    def bind(self, unit=None):
+        """Binds the texture to the given texture unit (through gl_state, for rendering) or to the active
+unit (to modify the texture)"""
+        if unit is not None:
+            gl_state.bindTexture(unit, self._type, self.id)
+            return
         glBindTexture( self._type, self.id )
+        gl_state.textureBound(self._type, self.id)
         if self._type == GL_TEXTURE_BUFFER:
             self._buffer.bind()
 
@@ -595,11 +949,24 @@ class Texture(GLObject):
             glBufferData ( GL_TEXTURE_BUFFER, data_size, ctypes.c_void_p(), GL_DYNAMIC_DRAW ) # alloc
             glBufferSubData( GL_TEXTURE_BUFFER, 0, data_size, data) # fill
 
+    def update(self, data, offset=0, entry_size=None):
+        """Overwrite part of a texture buffer without reallocating it, offset is given in entries"""
+        assert self._type == GL_TEXTURE_BUFFER
+        if entry_size is None:
+            entry_size = ctypes.sizeof(ctypes.c_float)
+        self.bind()
+        glBufferSubData( GL_TEXTURE_BUFFER, offset*entry_size, entry_size*len(data), data)
+
 
 class Query(GLObject):
-    def __init__(self, query_type):
+    """Query object, used as context manager. By default the result is read (waiting for the GPU) and the
+query is deleted at the end of the block. With wait=False the result is checked later with available()
+and result(), and the query must be deleted with delete()."""
+    def __init__(self, query_type, wait=True):
         self._type = query_type
+        self._wait = wait
         self._id = glGenQueries(1)[0]
+        self.value = None
 
     def __enter__(self):
         glBeginQuery(self._type , self.id)
@@ -607,11 +974,39 @@ class Query(GLObject):
 
     def __exit__(self ,type, value, traceback):
         glEndQuery(self._type)
-        ready = False
-        while not ready:
-            ready = glGetQueryObjectiv(self.id,GL_QUERY_RESULT_AVAILABLE)
-        self.value = glGetQueryObjectuiv(self.id, GL_QUERY_RESULT )
+        if self._wait:
+            self.value = self.result()
+            self.delete()
+
+    def available(self):
+        """Returns True if the result is available without waiting"""
+        return bool(glGetQueryObjectiv(self.id, GL_QUERY_RESULT_AVAILABLE))
+
+    def result(self):
+        """Returns the result, waits until the GPU has finished the query"""
+        return glGetQueryObjectuiv(self.id, GL_QUERY_RESULT )
+
+    def delete(self):
         glDeleteQueries( [self.id] )
+        self._deleted()
+
+class TransformFeedback(GLObject):
+    """Transform feedback object, captures the output of a vertex/geometry shader into a buffer"""
+    def __init__(self):
+        self._id = glGenTransformFeedbacks(1)
+
+    def bind(self, buffer=None):
+        """Binds the transform feedback object and attaches the given ArrayBuffer to it"""
+        glBindTransformFeedback(GL_TRANSFORM_FEEDBACK, self.id)
+        if buffer is not None:
+            glBindBufferBase(GL_TRANSFORM_FEEDBACK_BUFFER, 0, buffer.id)
+
+    def draw(self, mode=GL_POINTS, instances=None):
+        """Draws the primitives captured by the last feedback pass (instanced if instances is given)"""
+        if instances is None:
+            glDrawTransformFeedback(mode, self.id)
+        else:
+            glDrawTransformFeedbackInstanced(mode, self.id, instances)
 
 class TextRenderer:
     class Font:
@@ -672,6 +1067,7 @@ class TextRenderer:
             glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST )
             glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST )
 
+    @profiler.profiled("text")
     def draw(self, rendering_params, text, pos, font_size=0, use_absolute_pos=True, alignment=QtCore.Qt.AlignTop|QtCore.Qt.AlignLeft):
         with self._vao:
             if not font_size in self.fonts:
@@ -686,9 +1082,8 @@ class TextRenderer:
             uniforms = prog.uniforms
 
             font = self.fonts[font_size]
-            glActiveTexture(GL_TEXTURE0)
             uniforms.set('font', 0)
-            font.tex.bind()
+            font.tex.bind(0)
 
             uniforms.set('font_width_in_texture', font.width/font.tex_width)
             uniforms.set('font_height_in_texture', font.height/font.tex_height)
@@ -728,5 +1123,5 @@ class TextRenderer:
             glVertexAttribIPointer(char_id, 1, GL_UNSIGNED_BYTE, 0, ctypes.c_void_p());
             glEnableVertexAttribArray( char_id )
 
-            glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+            gl_state.polygonMode(GL_FILL)
             glDrawArrays(GL_POINTS, 0, len(s))
@@ -2,9 +2,17 @@ import OpenGL.GL as GL
 from .gl import Texture
 import ngsolve as ngs
 import netgen.meshing
-from .thread import inmain_decorator
+import itertools, copy
+from .thread import inmain_decorator, BackgroundTask, backgroundTasksEnabled
+from .cache import FileCache, MemoryCache
+from .lod import SurfaceLOD, prepareSurfaceLevels, clusterPoints
+from .bvh import ElementBVH, intersectTriangles, maskRanges, mergeRanges
 
 def getP2Rules():
+    """Integration rules of the points needed for the P2 interpolation of curved elements, the result
+is shared and must not be changed"""
+    if getP2Rules._cache is not None:
+        return getP2Rules._cache
     res = {}
     res[ngs.ET.SEGM] = ngs.IntegrationRule([(0,0,0), (1.0,0,0), (0.5,0,0)], [0.0]*3)
 
@@ -44,34 +52,158 @@ def getP2Rules():
 #             ir_hex.Append(IntegrationPoint(x,y,0.5));
 #         for (auto & ip : ir_quad.Range(4,9))
 #             ir_hex.Append(IntegrationPoint(ip(0), ip(1), 1.0));
+    getP2Rules._cache = res
     return res
 
+getP2Rules._cache = None
+
+def getReferencePoints(order, sd):
+    """Reference coordinates (numpy arrays of shape (npoints, 3)) of the points the functions are
+evaluated in, for each element type. The points of the elements are ordered like the values in the
+shaders (see interpolation.inc)."""
+    import numpy
+    key = (order, sd)
+    cache = getReferencePoints._cache
+    if key not in cache:
+        n = order*(sd+1)+1
+        h = 1.0/(n-1)
+        # grid indices, the last one varies fastest
+        k, j, i = numpy.indices((n,n,n)).reshape(3,-1)
+        def points(x, y=None, z=None, select=Ellipsis):
+            p = numpy.zeros((len(x), 3))
+            for d, c in enumerate((x, y, z)):
+                if c is not None:
+                    p[:,d] = c*h
+            return p[select]
+        res = {}
+        res[ngs.ET.SEGM] = points(numpy.arange(n))
+        res[ngs.ET.SEGM][:,0] = 1.0-res[ngs.ET.SEGM][:,0]
+        # 2d elements use the k=0 layer of the grid
+        layer = k == 0
+        res[ngs.ET.TRIG] = points(i[layer], j[layer], select=(i+j < n)[layer])
+        res[ngs.ET.QUAD] = points(i[layer], j[layer])
+        res[ngs.ET.TET] = points(i, j, k, select=i+j+k < n)
+        res[ngs.ET.HEX] = points(i, j, k)
+        res[ngs.ET.PRISM] = points(i, j, k, select=i+j < n)
+        # no subdivision or high order for pyramids
+        res[ngs.ET.PYRAMID] = numpy.array([(0,0,0), (1,0,0), (0,1,0), (1,1,0), (0,0,1)], dtype=numpy.float64)
+        cache[key] = res
+    return cache[key]
+
+getReferencePoints._cache = {}
+
 def getReferenceRules(order, sd):
-  n = (order)*(sd+1)+1;
-  h = 1.0/(n-1);
-  res = {}
-  n2 = n*(n+1)//2
-  n3 = n*(n+1)*(n+2)//6
-  res[ngs.ET.SEGM] = ngs.IntegrationRule([ (1.0-i*h,0.0,0.0) for i in range(n) ], [0.0 for i in range(n)])
-  res[ngs.ET.TRIG] = ngs.IntegrationRule([ (    i*h,j*h,0.0) for j in range(n) for i in range(n-j) ], [0.0]*n2)
-  res[ngs.ET.QUAD] = ngs.IntegrationRule([ (    i*h,j*h,0.0) for j in range(n) for i in range(n) ],   [0.0]*(n+1)**2)
-  res[ngs.ET.TET]  = ngs.IntegrationRule([ (    i*h,j*h,k*h) for k in range(n) for j in range(n-k) for i in range(n-k-j) ],   [0.0]*n3)
-  res[ngs.ET.HEX]  = ngs.IntegrationRule([ (    i*h,j*h,k*h) for k in range(n) for j in range(n) for i in range(n) ],   [0.0]*(n+1)**3)
-  res[ngs.ET.PRISM]= ngs.IntegrationRule([ (    i*h,j*h,k*h) for k in range(n) for j in range(n) for i in range(n-j) ], [0.0]*((n+1)*n2))
-
-  # no subdivision or high order for pyramids
-  n = 2;
-  h = 1.0/(n-1);
-  res[ngs.ET.PYRAMID]= ngs.IntegrationRule([ (    i*h*(1.0-0*h),j*h*(1.0-0*h),k*h) for k in range(n) for j in range(n-k) for i in range(n-k) ], [0.0]*(n*(n+1)*(n+2*n+1)//6))
-  return res
+    """Integration rules of the points the functions are evaluated in (see getReferencePoints), the
+result is shared and must not be changed"""
+    key = (order, sd)
+    cache = getReferenceRules._cache
+    if key not in cache:
+        cache[key] = { et : ngs.IntegrationRule(list(map(tuple, points.tolist())), [0.0]*len(points))
+                       for et, points in getReferencePoints(order, sd).items() }
+    return cache[key]
+
+getReferenceRules._cache = {}
+
+# evaluated function values (the data of the value textures, see BaseMeshScene._prepareValues). The
+# arrays are cached instead of the textures, since the scenes own and overwrite their value textures and
+# a cached texture could not be freed while some scene still draws it. The size of an entry is the
+# memory of its values as float32 textures.
+values_cache = MemoryCache(max_size=256*1024**2)
+# incremented by Draw and Redraw, since user code may have changed the drawn functions (see invalidateValues)
+values_cache.generation = 0
+# id of a cached cf or mesh -> weakref.finalize removing its entries when it is garbage collected
+_values_finalizers = {}
+# id of a GridFunction -> (weakref, generation, stamp) of the last change stamp computed for its vector
+_vector_stamps = {}
+
+def invalidateValues():
+    """Called by Draw and Redraw: functions without a change stamp of their own (everything but
+GridFunctions) may have changed, so their cached values are not used anymore. Values which are still
+computed in the background for the old generation are never looked up."""
+    values_cache.generation += 1
+    for key in values_cache.keys():
+        if key[3][0] == 'generation':
+            values_cache.remove(key)
+
+def _dropValues(obj_id, stamp=None):
+    """Removes the entries of the cf or mesh obj_id, only those with the change stamp if given"""
+    if stamp is None:
+        _values_finalizers.pop(obj_id, None)
+        _vector_stamps.pop(obj_id, None)
+    for key in values_cache.keys():
+        if obj_id in key[0:2] and (stamp is None or key[3] == stamp):
+            values_cache.remove(key)
+
+def _watchValues(obj):
+    """Removes the entries of obj from values_cache when it is garbage collected"""
+    import weakref
+    if id(obj) not in _values_finalizers:
+        _values_finalizers[id(obj)] = weakref.finalize(obj, _dropValues, id(obj))
+
+def _getChangeStamp(cf):
+    """Change stamp of the values of cf: the checksum of the vector of a GridFunction, computed at most
+once per generation (ngsolve vectors have no timestamp), the current generation for all other functions"""
+    import weakref, zlib
+    generation = values_cache.generation
+    if not isinstance(cf, ngs.GridFunction):
+        return ('generation', generation)
+    ref, stamp_generation, stamp = _vector_stamps.get(id(cf), (None, None, None))
+    if ref is not None and ref() is cf and stamp_generation == generation:
+        return stamp
+    try:
+        data = cf.vec.FV().NumPy()
+        new_stamp = ('vector', len(data), zlib.crc32(memoryview(data).cast('B')))
+    except Exception:
+        return ('generation', generation)
+    if ref is not None and ref() is cf and stamp != new_stamp:
+        # the vector changed, the values of its old state are never looked up again
+        _dropValues(id(cf), stamp)
+    _vector_stamps[id(cf)] = (weakref.ref(cf), generation, new_stamp)
+    _watchValues(cf)
+    return new_stamp
+
+def getValuesKey(cf, mesh, vb, order, sd, covariant=False):
+    """Key of the values of cf in values_cache, None if they can not be cached (the cf can not be
+referenced weakly). The cache entry does not keep the cf or the mesh alive, entries are removed when
+they are garbage collected."""
+    import weakref
+    if not values_cache.enabled:
+        return None
+    try:
+        weakref.ref(cf)
+    except TypeError:
+        return None
+    return (id(cf), id(mesh), mesh.ngmesh._timestamp, _getChangeStamp(cf), vb, order, sd, covariant)
+
+def storeValues(key, cf, mesh, values):
+    """Stores the values of cf in values_cache. The entry keeps weak references to cf and mesh, so a
+lookup for other objects reusing their ids never returns it."""
+    import weakref
+    cf_ref, mesh_ref = weakref.ref(cf), weakref.ref(mesh)
+    if cf_ref() is not cf or mesh_ref() is not mesh or key[0:2] != (id(cf), id(mesh)):
+        return
+    _watchValues(cf)
+    _watchValues(mesh)
+    size = sum(4*len(data) for comp in ('real', 'imag') for data in values.get(comp, {}).values())
+    values_cache.store(key, (cf_ref, mesh_ref, values), size)
+
+def lookupValues(key, cf, mesh):
+    entry = values_cache.lookup(key)
+    if entry is None:
+        return None
+    cf_ref, mesh_ref, values = entry
+    if cf_ref() is not cf or mesh_ref() is not mesh:
+        values_cache.remove(key)
+        return None
+    return values
 
 class DataContainer:
     """Class to avoid redundant copies of same objects on GPU"""
-    def __init__(self, obj):
+    def __init__(self, obj, *args, **kwargs):
         import weakref
         self.obj = weakref.ref(obj)
         obj._opengl_data = self
-        self.update()
+        self.update(*args, **kwargs)
 
     def update(self):
         self.timestamp = self.getTimestamp()
@@ -186,41 +318,431 @@ class MeshData(DataContainer):
             assert len(ei['data']) == self.nelements*self.size
             self.tex_vertices = vertices
             self.tex = eldata
+            # key of the values of this block in BaseMeshScene._getValues, and if the block is a
+            # decimated surface (see lod.py)
+            self.key = (self.type, self.curved)
+            self.lod = False
+            # bounding volume hierarchy for culling, only for large blocks
+            self.bvh = None
+            # ranges (first, count) of the elements to draw, None for all elements of the block
+            self.ranges = None
+            # the parts the block is drawn in, curved blocks are split into views of their (nearly)
+            # straight elements, which are drawn without tessellation, and the curved ones
+            # (see MeshData._classifyStraight)
+            self.parts = [self]
+
+        def view(self, ranges, curved):
+            """Element data drawing only the given ranges of this block. The view shares data, values
+and bounding volume hierarchy with this block, so element numbers stay the same."""
+            view = copy.copy(self)
+            view.ranges = ranges
+            view.curved = curved
+            view.parts = [view]
+            return view
+
+    # curved elements whose P2 midpoints deviate less than this (relative to the edge length) from the
+    # straight edges and whose vertex normals are parallel to the flat normal are drawn without tessellation
+    straight_tolerance = 1e-5
+    # P2 midpoints of curved elements: (index after the curved data offset, vertices of the edge)
+    _p2_midpoints = { ngs.ET.SEGM: [(2, (0,1))],
+                      ngs.ET.TRIG: [(3, (2,0)), (4, (2,1)), (5, (0,1))],
+                      ngs.ET.QUAD: [(4, (0,1)), (5, (0,3)), (6, (0,1,2,3)), (7, (1,2)), (8, (3,2))] }
+
+    # on-disk cache of visualization data for meshes loaded from files (see scenes._LoadMesh)
+    disk_cache = FileCache("meshes", max_size=4*1024**3)
+    _cache_format = 1
+
+    # counts calls of prepare, used to discard outdated data computed in background threads
+    _prepare_counter = itertools.count(1)
 
     @inmain_decorator(True)
-    def __init__(self, mesh):
+    def __init__(self, mesh, prepared=None):
         self.vertices = Texture(GL.GL_TEXTURE_BUFFER, GL.GL_RGB32F)
         self.elements = {}
-        super().__init__(mesh)
+        self._prepare_number = 0
+        # the last uploaded data, its element data is reused while the topology does not change
+        self._prepared = None
+        # host copies of the uploaded data, used to upload only the parts which changed
+        self._vertex_data = None
+        self._element_data = {}
+        self._element_textures = {}
+        # decimated surfaces for fastmode, computed in the background
+        self.lod = {}
+        self._lod_prepared = None
+        self._lod_task = BackgroundTask(MeshData._prepareLOD, lambda levels: setattr(self, "_lod_prepared", levels))
+        # (vb, level) -> textures of the vertices and elements of the decimated surface, reused like
+        # the element textures
+        self._lod_textures = {}
+        # (vb, level) -> clusters of the decimated surface, to move it with the mesh vertices
+        self._lod_clusters = {}
+        # the vertices moved since the decimated surfaces were uploaded
+        self._lod_points_changed = False
+        super().__init__(mesh, prepared)
 
     def getTimestamp(self):
         return self.obj().ngmesh._timestamp
 
-    @inmain_decorator(True)
-    def update(self):
-        import numpy
-        data = ngs.solve._GetVisualizationData( self.obj(), getP2Rules() )
-
-        self.elements = {}
-        self.min = data.pop('min')
-        self.max = data.pop('max')
-        self.vertices.store(data.pop('vertices'))
-
+    # changed spans closer than upload_gap entries are uploaded together, at most upload_ranges calls
+    upload_gap = 1024
+    upload_ranges = 16
+
+    @staticmethod
+    def _changedRanges(old, new, max_gap=0, max_ranges=None):
+        """Returns the ranges (first, count) of entries which differ in the
+        equally sized arrays old and new (see bvh.mergeRanges)"""
+        return mergeRanges(maskRanges(old != new), max_gap, max_ranges)
+
+    def _upload(self, tex, old, new):
+        """Uploads the changed spans of new, returns if anything changed"""
+        if old is new:
+            return False
+        if old is None or len(old) != len(new):
+            tex.store(new)
+            return True
+        first, count = self._changedRanges(old, new, self.upload_gap, self.upload_ranges)
+        for f, c in zip(first, count):
+            tex.update(new[f:f+c], offset=int(f))
+        return len(first) > 0
+
+    @staticmethod
+    def _getCacheKey(mesh):
+        """Key of the mesh in the disk cache, None if the mesh was not loaded from a file or was
+changed afterwards (e.g. by refinement or curving)"""
+        if not hasattr(mesh, "_ngsgui_file_hash"):
+            return None
+        file_hash, timestamp = mesh._ngsgui_file_hash
+        if timestamp != mesh.ngmesh._timestamp:
+            return None
+        return (file_hash, ngs.__version__, MeshData._cache_format)
+
+    @staticmethod
+    def _writeCache(data, directory):
+        import numpy, json, os
+        meta = { "min" : list(data["min"]), "max" : list(data["max"]), "vbs" : [] }
+        numpy.save(os.path.join(directory, "vertices.npy"), numpy.asarray(data["vertices"], dtype=numpy.float32))
         for vb in data:
-            tex = Texture(GL.GL_TEXTURE_BUFFER, GL.GL_R32I)
-            eldata = []
-            els = []
-            for ei in data[vb]:
-                if type(ei) != type({}):
-                    eldata += list(ei)
-            for ei in data[vb]:
+            if vb in ("min", "max", "vertices"):
+                continue
+            # besides VorB there are also string keys like "edges" or "periodic"
+            vbname = vb if isinstance(vb, str) else vb.name
+            blocks = []
+            for i, ei in enumerate(data[vb]):
+                filename = "{}_{}.npy".format(vbname, i)
                 if type(ei) == type({}):
-                    els.append(MeshData.ElementData(ei, self.vertices, tex, offset=len(eldata)))
-                    eldata += ei['data']
-#                 else:
-#                     eldata += list(ei)
-            self.elements[vb] = els
-            tex.store(numpy.array(eldata, dtype=numpy.int32))
+                    numpy.save(os.path.join(directory, filename), numpy.asarray(ei["data"], dtype=numpy.int32))
+                    blocks.append({ "file" : filename, "type" : ei["type"].name,
+                                    "nelements" : ei["nelements"], "curved" : bool(ei["curved"]) })
+                else:
+                    numpy.save(os.path.join(directory, filename), numpy.asarray(ei, dtype=numpy.int32))
+                    blocks.append({ "file" : filename })
+            meta["vbs"].append({ "vb" : vbname, "is_vorb" : not isinstance(vb, str), "blocks" : blocks })
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def _readCache(directory):
+        """Reads data in the format of _GetVisualizationData, arrays are memory mapped"""
+        import numpy, json, os
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        load = lambda filename: numpy.load(os.path.join(directory, filename), mmap_mode="r")
+        data = { "min" : meta["min"], "max" : meta["max"], "vertices" : load("vertices.npy") }
+        for vbmeta in meta["vbs"]:
+            vbdata = []
+            for block in vbmeta["blocks"]:
+                if "type" in block:
+                    vbdata.append({ "data" : load(block["file"]), "type" : getattr(ngs.ET, block["type"]),
+                                    "nelements" : block["nelements"], "curved" : block["curved"] })
+                else:
+                    vbdata.append(load(block["file"]))
+            vb = getattr(ngs.VorB, vbmeta["vb"]) if vbmeta["is_vorb"] else vbmeta["vb"]
+            data[vb] = vbdata
+        return data
+
+    @staticmethod
+    def _getVisualizationData(mesh):
+        import logging
+        key = MeshData._getCacheKey(mesh)
+        if key is not None:
+            path = MeshData.disk_cache.lookup(key)
+            if path is not None:
+                try:
+                    return MeshData._readCache(path)
+                except Exception as e:
+                    logging.getLogger(__name__).warning("Invalid mesh cache entry {}: {}".format(path, e))
+                    MeshData.disk_cache.remove(key)
+        data = ngs.solve._GetVisualizationData( mesh, getP2Rules() )
+        if key is not None:
+            MeshData.disk_cache.store(key, lambda directory: MeshData._writeCache(data, directory))
+        return data
+
+    @staticmethod
+    def _getTopology(mesh):
+        """Numbers of points and elements and the curve order of the mesh. As long as they do not change
+(e.g. only points are moved), the element data, hierarchies and straight elements are reused."""
+        ngmesh = mesh.ngmesh
+        return (len(ngmesh.Points()), len(ngmesh.Elements0D()), len(ngmesh.Elements1D()),
+                len(ngmesh.Elements2D()), len(ngmesh.Elements3D()), ngmesh.GetCurveOrder())
+
+    @staticmethod
+    def _getMovedVertices(mesh, previous):
+        """Vertex data of a mesh with moved points and the topology of the previous data, computed from
+the point coordinates. None if the vertex data also contains curved geometry (normals or midpoints
+of curve order > 1), then it has to be computed by ngsolve."""
+        import numpy
+        ngmesh = mesh.ngmesh
+        if ngmesh.GetCurveOrder() > 1:
+            return None
+        for eldata, infos, offsets, bvhs, straight in previous["elements"].values():
+            for ei in infos:
+                # curved segments of straight meshes only store their midpoints, no normals
+                if ei['curved'] and ei['nelements'] > 0 and ei['type'] != ngs.ET.SEGM:
+                    return None
+        coordinates = ngmesh.Coordinates()
+        vertices = previous["vertices"].reshape(-1,3).copy()
+        vertices[:len(coordinates), :coordinates.shape[1]] = coordinates
+        for eldata, infos, offsets, bvhs, straight in previous["elements"].values():
+            for ei, offset in zip(infos, offsets):
+                if not ei['curved'] or ei['nelements'] == 0:
+                    continue
+                size = len(ei['data'])//ei['nelements']
+                rows = eldata[offset:offset+len(ei['data'])].reshape(-1, size)
+                for index, edge in MeshData._p2_midpoints[ei['type']]:
+                    vertices[rows[:,-1]+index] = vertices[rows[:,2+numpy.array(edge)]].mean(axis=1)
+        return vertices.ravel()
+
+    @staticmethod
+    def prepare(mesh, previous=None):
+        """Computes the visualization data of the mesh on the CPU, this does not use OpenGL and can be
+called from any thread. The result is uploaded with MeshData.update. If the topology did not change
+since the previously prepared data, only the vertex data and the bounding boxes are computed again."""
+        import numpy
+        prepared = { "number" : next(MeshData._prepare_counter),
+                     "timestamp" : mesh.ngmesh._timestamp,
+                     "topology" : MeshData._getTopology(mesh) }
+        if previous is not None and previous["topology"] == prepared["topology"]:
+            vertices = MeshData._getMovedVertices(mesh, previous)
+            if vertices is None:
+                vertices = numpy.asarray(MeshData._getVisualizationData(mesh)['vertices'], dtype=numpy.float32).ravel()
+            prepared["vertices"] = vertices
+            points = vertices.reshape(-1,3)
+            # the vertex data starts with the mesh points
+            nv = prepared["topology"][0]
+            prepared["min"] = ngs.Vector(points[:nv].min(axis=0).tolist())
+            prepared["max"] = ngs.Vector(points[:nv].max(axis=0).tolist())
+            prepared["elements"] = { vb : (eldata, infos, offsets, [bvh and bvh.refit(points) for bvh in bvhs], straight)
+                                     for vb, (eldata, infos, offsets, bvhs, straight) in previous["elements"].items() }
+            return prepared
+        data = MeshData._getVisualizationData(mesh)
+        prepared["min"] = data.pop('min')
+        prepared["max"] = data.pop('max')
+        prepared["vertices"] = numpy.asarray(data.pop('vertices'), dtype=numpy.float32).ravel()
+
+        prepared["elements"] = {}
+        for vb in data:
+            # additional (non element) data is stored in front of the element blocks
+            blocks = [ei for ei in data[vb] if type(ei) != type({})]
+            infos = [ei for ei in data[vb] if type(ei) == type({})]
+            blocks += [ei['data'] for ei in infos]
+
+            # copy all blocks into one preallocated array, this avoids building
+            # (and converting) a huge python list of all element data
+            eldata = numpy.empty(sum(len(block) for block in blocks), dtype=numpy.int32)
+            offset = 0
+            offsets = []
+            for block in blocks:
+                offsets.append(offset)
+                eldata[offset:offset+len(block)] = block
+                offset += len(block)
+            offsets = offsets[len(blocks)-len(infos):]
+            bvhs = [MeshData._buildBVH(prepared["vertices"], eldata, ei, offset) for ei, offset in zip(infos, offsets)]
+            straight = [MeshData._classifyStraight(prepared["vertices"], eldata, ei, offset) for ei, offset in zip(infos, offsets)]
+            prepared["elements"][vb] = (eldata, infos, offsets, bvhs, straight)
+        return prepared
+
+    @staticmethod
+    def _buildBVH(vertices, eldata, ei, offset):
+        nverts = MeshData.ElementData.nverts[ei['type']]
+        if ei['nelements'] < ElementBVH.min_elements or ei['type'] == ngs.ET.POINT:
+            return None
+        size = len(ei['data'])//ei['nelements']
+        rows = eldata[offset:offset+len(ei['data'])].reshape(-1, size)
+        return ElementBVH(vertices.reshape(-1,3), rows, nverts, ei['curved'])
+
+    @staticmethod
+    def _classifyStraight(vertices, eldata, ei, offset):
+        """Returns a boolean array marking the elements of a curved block which are (nearly) straight,
+None if the block is not curved or has no P2 midpoints"""
+        import numpy
+        if not ei['curved'] or ei['type'] not in MeshData._p2_midpoints or ei['nelements'] == 0:
+            return None
+        nverts = MeshData.ElementData.nverts[ei['type']]
+        size = len(ei['data'])//ei['nelements']
+        rows = eldata[offset:offset+len(ei['data'])].reshape(-1, size)
+        points = vertices.reshape(-1,3).astype(numpy.float64)
+        p = points[rows[:,2:2+nverts]]
+        curved_offsets = rows[:,-1]
+        straight = numpy.ones(len(rows), dtype=bool)
+        for index, edge in MeshData._p2_midpoints[ei['type']]:
+            mid = points[curved_offsets+index]
+            ends = p[:,edge]
+            length = numpy.linalg.norm(ends[:,-1]-ends[:,0], axis=1)
+            deviation = numpy.linalg.norm(mid-ends.mean(axis=1), axis=1)
+            straight &= deviation <= MeshData.straight_tolerance*length
+        if nverts > 2:
+            # curved surface elements are shaded with the vertex normals stored in front of the midpoints
+            flat = numpy.cross(p[:,1]-p[:,0], p[:,2]-p[:,0])
+            for i in range(nverts):
+                normal = points[curved_offsets+i]
+                cos = numpy.abs((flat*normal).sum(axis=1))
+                norms = numpy.linalg.norm(flat, axis=1)*numpy.linalg.norm(normal, axis=1)
+                straight &= cos >= (1-MeshData.straight_tolerance)*numpy.maximum(norms, 1e-30)
+        return straight
+
+    @inmain_decorator(True)
+    def update(self, prepared=None):
+        if prepared is None:
+            prepared = MeshData.prepare(self.obj(), self._prepared)
+        # data prepared in background threads can arrive in the wrong order
+        if prepared["number"] < self._prepare_number:
+            return
+        self._prepare_number = prepared["number"]
+        self._prepared = prepared
+        self.timestamp = prepared["timestamp"]
+
+        self.min = prepared["min"]
+        self.max = prepared["max"]
+        # moving meshes only change the vertex data, in this case we only update the changed range
+        vertices = prepared["vertices"]
+        topology_changed = self._vertex_data is None or len(self._vertex_data) != len(vertices)
+        self._upload(self.vertices, self._vertex_data, vertices)
+        self._vertex_data = vertices
+
+        elements = {}
+        for vb, (eldata, infos, offsets, bvhs, straight) in prepared["elements"].items():
+            # reuse the texture of this vb, only changed topology is uploaded again
+            if vb not in self._element_textures:
+                self._element_textures[vb] = Texture(GL.GL_TEXTURE_BUFFER, GL.GL_R32I)
+            tex = self._element_textures[vb]
+            topology_changed |= self._upload(tex, self._element_data.get(vb), eldata)
+            self._element_data[vb] = eldata
+
+            elements[vb] = []
+            for ei, offset, bvh, is_straight in zip(infos, offsets, bvhs, straight):
+                block = MeshData.ElementData(ei, self.vertices, tex, offset=offset)
+                block.bvh = bvh
+                if is_straight is not None and is_straight.any():
+                    block.parts = [block.view(maskRanges(is_straight), False)]
+                    if not is_straight.all():
+                        block.parts.append(block.view(maskRanges(~is_straight), True))
+                elements[vb].append(block)
+        topology_changed |= set(elements) != set(self.elements)
+        self.elements = elements
+
+        if not topology_changed:
+            # the decimated surfaces (also the ones still computed) are moved with the vertices
+            self._lod_points_changed = True
+            return
+        self.lod = {}
+        self._lod_prepared = None
+        if SurfaceLOD.enabled and backgroundTasksEnabled():
+            self._lod_task.start(vertices, dict(self._element_data), elements)
+
+    @staticmethod
+    def _prepareLOD(vertices, eldata, elements):
+        return { vb : prepareSurfaceLevels(vertices, eldata[vb], elements[vb])
+                 for vb in (ngs.VOL, ngs.BND) if vb in elements }
+
+    def _uploadLOD(self):
+        self._lod_clusters = {}
+        for vb, levels in self._lod_prepared.items():
+            lod_levels = []
+            for level, (points, eldata, parts, clusters) in enumerate(levels):
+                if (vb, level) not in self._lod_textures:
+                    self._lod_textures[vb, level] = (Texture(GL.GL_TEXTURE_BUFFER, GL.GL_RGB32F),
+                                                     Texture(GL.GL_TEXTURE_BUFFER, GL.GL_R32I))
+                tex_vertices, tex = self._lod_textures[vb, level]
+                # the vertices may have moved while the levels were computed
+                tex_vertices.store(clusterPoints(self._vertex_data, clusters).ravel())
+                tex.store(eldata)
+                self._lod_clusters[vb, level] = clusters
+                blocks = []
+                for source, offset, n in parts:
+                    ei = { 'type' : ngs.ET.TRIG, 'nelements' : n, 'curved' : False,
+                           'data' : eldata[offset:offset+5*n] }
+                    block = MeshData.ElementData(ei, tex_vertices, tex, offset=offset)
+                    # values are taken from the source block
+                    block.key = source.key
+                    block.lod = True
+                    blocks.append(block)
+                lod_levels.append(blocks)
+            if lod_levels:
+                self.lod[vb] = SurfaceLOD(lod_levels)
+        self._lod_prepared = None
+        self._lod_points_changed = False
+
+    def _moveLOD(self):
+        for (vb, level), clusters in self._lod_clusters.items():
+            self._lod_textures[vb, level][0].store(clusterPoints(self._vertex_data, clusters).ravel())
+        self._lod_points_changed = False
+
+    def getLODElements(self, vb, frame_time=0):
+        """Element blocks to draw in fastmode, the triangle blocks are replaced by a decimated surface
+if one is available (must be called with current OpenGL context)"""
+        if self._lod_prepared is not None:
+            self._uploadLOD()
+        elif self._lod_points_changed:
+            self._moveLOD()
+        if vb not in self.lod:
+            return self.elements[vb]
+        return self.lod[vb].select(frame_time) + [els for els in self.elements[vb] if els.type != ngs.ET.TRIG]
+
+    # vertices of the reference elements, to compute local coordinates of picked points
+    _reference_vertices = { ngs.ET.TRIG: [(1,0), (0,1), (0,0)],
+                            ngs.ET.QUAD: [(0,0), (1,0), (1,1), (0,1)] }
+
+    def pick(self, vb, origin, direction, planes=[]):
+        """Intersects the ray origin + t*direction with the surface elements of vb (straight geometry,
+on the CPU only). Hits outside the positive half spaces of the given planes are ignored. Returns a
+dict with the element number, region index, distance t, point and local coordinates of the nearest
+hit or None."""
+        import numpy
+        if vb not in self.elements or self._vertex_data is None:
+            return None
+        points = self._vertex_data.reshape(-1,3)
+        origin = numpy.asarray(origin, dtype=numpy.float64)
+        direction = numpy.asarray(direction, dtype=numpy.float64)
+        planes = numpy.asarray(planes, dtype=numpy.float64).reshape(-1,4)
+        best = None
+        for block in self.elements[vb]:
+            if block.type not in MeshData._reference_vertices:
+                continue
+            rows = self._element_data[vb][block.offset:block.offset+block.nelements*block.size].reshape(block.nelements, block.size)
+            if block.bvh is None:
+                candidates = numpy.arange(block.nelements)
+            else:
+                first, count = block.bvh.rayRanges(origin, direction)
+                candidates = numpy.concatenate([numpy.arange(f, f+c) for f,c in zip(first, count)] + [numpy.zeros(0, dtype=int)])
+            if len(candidates) == 0:
+                continue
+            verts = rows[candidates, 2:2+block.nverts]
+            ref = numpy.array(MeshData._reference_vertices[block.type], dtype=numpy.float64)
+            # split quads into triangles (0,1,2) and (0,2,3)
+            for i in range(1, block.nverts-1):
+                t, u, v = intersectTriangles(points[verts[:,0]], points[verts[:,i]], points[verts[:,i+1]], origin, direction)
+                if len(planes):
+                    hit_points = origin + numpy.outer(numpy.where(numpy.isfinite(t), t, 0), direction)
+                    visible = (hit_points.dot(planes[:,:3].T) + planes[:,3] >= 0).all(axis=1)
+                    t = numpy.where(visible, t, numpy.inf)
+                k = numpy.argmin(t)
+                if numpy.isfinite(t[k]) and (best is None or t[k] < best['distance']):
+                    el = candidates[k]
+                    best = { 'nr' : int(rows[el,0]),
+                             'index' : int(rows[el,1]),
+                             'distance' : float(t[k]),
+                             'point' : origin + t[k]*direction,
+                             'local' : (1-u[k]-v[k])*ref[0] + u[k]*ref[i] + v[k]*ref[i+1] }
+        return best
 
 def getMeshData(mesh):
     if hasattr(mesh,"_opengl_data"):
@@ -258,6 +780,22 @@ class GeoData(DataContainer):
 _opengl_data_constructors = {ngs.Mesh : MeshData,
                              netgen.meshing.NetgenGeometry : GeoData}
 
+def prepareOpenGLData(obj):
+    """Computes the data needed by getOpenGLData as far as possible without OpenGL, so that it can be
+done in a worker thread. Returns a function which must be called in the main thread, it uploads the
+data and returns the data container (same as getOpenGLData)."""
+    if isinstance(obj, ngs.Mesh):
+        previous = obj._opengl_data._prepared if hasattr(obj, "_opengl_data") else None
+        prepared = MeshData.prepare(obj, previous)
+        def upload():
+            if hasattr(obj, "_opengl_data"):
+                obj._opengl_data.update(prepared)
+            else:
+                MeshData(obj, prepared)
+            return obj._opengl_data
+        return upload
+    return lambda: getOpenGLData(obj)
+
 def getOpenGLData(obj):
     if not hasattr(obj, "_opengl_data"):
         for key in _opengl_data_constructors:
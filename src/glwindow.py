@@ -1,11 +1,11 @@
 
 from . import glmath, scenes
 from . import widgets as wid
-from .gl import TextRenderer, ArrayBuffer, VertexArray, getProgram, Texture
+from .gl import TextRenderer, ArrayBuffer, VertexArray, getProgram, Texture, debug_log
 from .widgets import ArrangeV, ArrangeH, addShortcut
 from .thread import inmain_decorator
 from .toolbox import SceneToolBox
-from ngsgui import _debug
+from .profiler import profiler, GPUTimer
 import numpy as np
 
 import time, ngsolve, weakref
@@ -75,13 +75,27 @@ class WindowTab(QtWidgets.QWidget):
 
 class GLWidget(QtOpenGL.QGLWidget):
     _trace_paintGL_calls = False
+    # show the picked element and function value as tooltip when hovering over the scene
+    _pick_tooltips = False
+    # compile likely needed shader variants in idle time, see warmUpShaders
+    _warm_up_shaders = True
+    # maximal frame rate of repaints requested with scheduleFrame (None for no limit)
+    _max_fps = 60
+    # tessellation levels of large element blocks in the frames painted progressively after interaction
+    # ends, the last one is the full quality
+    _refinement_levels = [1, 4, 10]
+    # GPU time (in seconds) of the scenes in a full quality frame, the tessellation tolerance of curved
+    # elements is adapted to keep it (None for a fixed tolerance)
+    _tess_budget = 0.03
+    # range of the adapted tessellation tolerance in pixels
+    _tess_tolerance_range = (0.5, 64.0)
     def __init__(self,shared=None, rendering_parameters=None, *args, **kwargs):
         f = QtOpenGL.QGLFormat()
         f.setVersion(3,2)
         f.setSamples(8)
         # f.setProfile(QtOpenGL.QGLFormat.CompatibilityProfile)
         f.setProfile(QtOpenGL.QGLFormat.CoreProfile)
-        if _debug:
+        if debug_log.enabled:
             f.setOption(QtGui.QSurfaceFormat.DebugContext)
         QtOpenGL.QGLFormat.setDefaultFormat(f)
         super().__init__(shareWidget=shared, *args, **kwargs)
@@ -105,12 +119,128 @@ class GLWidget(QtOpenGL.QGLWidget):
 
         self.lastPos = QtCore.QPoint()
         self.lastFastmode = self._settings.fastmode
+        self.setMouseTracking(self._pick_tooltips)
+
+        # repaint requested by scheduleFrame, started when the minimal time between frames has passed
+        self._frame_timer = QtCore.QTimer()
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.timeout.connect(self.update)
+        # number of requests merged into an already scheduled frame
+        self.coalesced_frame_requests = 0
+
+        # remaining tessellation levels of the progressive refinement, next one is painted in idle time
+        self._refinement = []
+        self._refinement_timer = QtCore.QTimer()
+        self._refinement_timer.setSingleShot(True)
+        self._refinement_timer.timeout.connect(self._refine)
+        # GPU time of the scenes in full quality frames, for the tessellation budget
+        self._tess_timer = GPUTimer()
+
+        self._warm_up_queue = []
+        # number of programs prepared by warmUpShaders
+        self.warmed_up_programs = 0
+        # timeout 0 fires whenever the event loop is idle
+        self._warm_up_timer = QtCore.QTimer()
+        self._warm_up_timer.setInterval(0)
+        self._warm_up_timer.timeout.connect(self._warmUpNextProgram)
+
+    def warmUpShaders(self):
+        """Compiles (or loads from the on-disk program cache) the shader variants the scenes will likely
+need later (see BaseScene.getWarmUpPrograms), such that enabling e.g. clipping or iso surfaces does
+not stall rendering. One program is prepared per idle tick of the event loop."""
+        if not self._warm_up_shaders:
+            return
+        queue = []
+        for scene in self.scenes:
+            if scene.active and scene._gl_initialized:
+                queue += [(scene, shader, options) for shader, options in scene.getWarmUpPrograms()]
+        self._warm_up_queue = queue
+        if queue and not self._warm_up_timer.isActive():
+            self._warm_up_timer.start()
+
+    def _warmUpNextProgram(self):
+        if not self._warm_up_queue:
+            self._warm_up_timer.stop()
+            logger.info("Prepared {} shader programs in idle time".format(self.warmed_up_programs))
+            return
+        scene, shader, options = self._warm_up_queue.pop(0)
+        self.makeCurrent()
+        ncached = len(getProgram._cache)
+        try:
+            getProgram(*shader, params=self._settings, scene=scene, **options)
+        except Exception as e:
+            logger.warning("Shader warm up of {} failed: {}".format(shader, e))
+        self.warmed_up_programs += len(getProgram._cache)-ncached
+        self.doneCurrent()
 
 
     @inmain_decorator(True)
     def updateGL(self,*args,**kwargs):
         super().updateGL(*args,**kwargs)
 
+    @inmain_decorator(False)
+    def scheduleFrame(self):
+        """Requests a repaint without painting immediately. All requests until the frame is painted are
+merged into one paint and frames are painted at most _max_fps times per second. Nothing is painted
+(and no timer is running) while there are no requests."""
+        if self._frame_timer.isActive():
+            self.coalesced_frame_requests += 1
+            return
+        delay = 0
+        if self._max_fps:
+            delay = max(0, self.old_time + 1.0/self._max_fps - time.time())
+        self._frame_timer.start(int(1000*delay))
+
+    def _startRefinement(self):
+        """Leaves fastmode. Instead of painting the full quality frame at once, which can take long for large
+curved meshes, frames with increasing tessellation level are painted in idle time."""
+        self._settings.fastmode = False
+        self._refinement = list(self._refinement_levels)
+        self._refine()
+
+    def _refine(self):
+        if not self._refinement:
+            return
+        self._settings.tess_level = self._refinement.pop(0)
+        self.scheduleFrame()
+
+    def _abortRefinement(self):
+        self._refinement = []
+        self._refinement_timer.stop()
+        self._settings.tess_level = self._refinement_levels[-1]
+
+    def _measureTessellation(self):
+        """If the scenes of this frame count for the tessellation budget, their GPU time is measured if
+timer queries are available"""
+        rp = self._settings
+        measured = bool(self._tess_budget) and not rp.fastmode and not self._refinement
+        if measured and self._tess_timer is not None:
+            try:
+                self._tess_timer.begin()
+            except GL.GLError:
+                logger.warning("Timer queries are not available, the tessellation budget uses the CPU time")
+                self._tess_timer = None
+        return measured
+
+    def _adaptTessellation(self, measured):
+        """Coarsens the tessellation of curved elements if the scenes of the last measured full quality
+frame took longer than _tess_budget on the GPU and refines it again if they took less than half of it.
+The GPU time is read some frames later, without waiting for the GPU. Without timer queries the CPU
+time of the frame is used. Frames in fastmode are ignored, since large element blocks are drawn with
+tessellation level 1 there."""
+        rp = self._settings
+        if self._tess_timer is not None:
+            frame_time = self._tess_timer.read()
+        else:
+            frame_time = rp.frame_time if measured else None
+        if frame_time is None:
+            return
+        tmin, tmax = self._tess_tolerance_range
+        if frame_time > self._tess_budget:
+            rp.tess_tolerance = min(tmax, 1.5*rp.tess_tolerance)
+        elif frame_time < 0.5*self._tess_budget:
+            rp.tess_tolerance = max(tmin, rp.tess_tolerance/1.5)
+
     def ZoomReset(self):
         self._settings.rotmat = glmath.Identity()
         self._settings.zoom = 0.0
@@ -138,14 +268,20 @@ class GLWidget(QtOpenGL.QGLWidget):
         return QtCore.QSize(400, 400)
 
     def initializeGL(self):
+        if debug_log.enabled:
+            debug_log.enable()
         self.updateScenes()
 
-    def updateScenes(self):
+    def updateScenes(self, blocking=False):
         self.redraw_mutex.lock()
         self.makeCurrent()
         for scene in self.scenes:
             if scene.active:
                 scene.update()
+        if blocking:
+            for scene in self.scenes:
+                if scene.active:
+                    scene.waitForUpdate()
         self.redraw_update_done.wakeAll()
         self.redraw_mutex.unlock()
         self.update()
@@ -172,6 +308,7 @@ class GLWidget(QtOpenGL.QGLWidget):
         screen_height = viewport[3]-viewport[1]
         rp = self._settings
         rp.ratio = screen_width/max(screen_height,1)
+        rp.viewport_size = (screen_width, screen_height)
 
         for scene in self.scenes:
             if scene.active and hasattr(scene, "individualColormap") and scene.individualColormap and scene.getColormapAutoscale():
@@ -192,9 +329,23 @@ class GLWidget(QtOpenGL.QGLWidget):
             rp.setColormapMin(colormap_min)
             rp.setColormapMax(colormap_max)
             self.blockSignals(state)
+        render_start = time.time()
+        profiler.beginFrame()
+        rp.beginFrame()
+        measured = self._measureTessellation()
         for scene in self.scenes[1:]:
-            scene.render(rp)
-        rp.render(rp)
+            with profiler.section(scene.name):
+                scene.render(rp)
+        if measured and self._tess_timer is not None:
+            self._tess_timer.end()
+        with profiler.section(rp.name):
+            rp.render(rp)
+        profiler.endFrame()
+        rp.frame_time = time.time()-render_start
+        self._adaptTessellation(measured)
+        if self._refinement:
+            # paint the next refinement when the event loop is idle
+            self._refinement_timer.start(0)
 
     def addScene(self, scene):
         self.scenes.append(scene)
@@ -214,7 +365,37 @@ class GLWidget(QtOpenGL.QGLWidget):
         self._settings.max = box_max
         self.updateGL()
 
+    def pick(self, x, y):
+        """Casts a ray through the pixel (x,y) (in widget coordinates) and returns the nearest hit of all
+scenes (see BaseMeshScene.pick) or None. Does not use OpenGL, so it is cheap enough for hovering. The
+hit is on the straight surface elements and does not respect the clipping plane itself or hidden
+surfaces, so it is only used for information like the --pickTooltips."""
+        settings = self._settings
+        mvp = settings.projection*settings.view*settings.model
+        inv = np.linalg.inv(np.array([[mvp[i,j] for j in range(4)] for i in range(4)]))
+        ndc_x = 2*x/max(self.width(),1)-1
+        ndc_y = 1-2*y/max(self.height(),1)
+        near = inv.dot([ndc_x, ndc_y, -1, 1])
+        far = inv.dot([ndc_x, ndc_y, 1, 1])
+        origin = near[:3]/near[3]
+        direction = far[:3]/far[3]-origin
+        hits = [scene.pick(settings, origin, direction) for scene in self.scenes]
+        hits = [hit for hit in hits if hit is not None]
+        if not hits:
+            return None
+        return min(hits, key=lambda hit: hit['distance'])
+
+    def _pickToolTip(self, hit):
+        text = "{} {} ({})".format("Element" if hit['element'].VB() == ngsolve.VOL else "Surface element",
+                                   hit['element'].nr, hit['region'])
+        text += "\nPoint: ({})".format(", ".join("{:.6g}".format(p) for p in hit['point']))
+        if hit.get('value') is not None:
+            text += "\nValue: {}".format(hit['value'])
+        return text
+
     def mouseDoubleClickEvent(self, event):
+        # the depth buffer gives the point of what is actually drawn (clipping plane, curved elements,
+        # hidden surfaces), pick only knows the straight surface elements
         import OpenGL.GLU
         viewport = GL.glGetIntegerv( GL.GL_VIEWPORT )
         x = event.pos().x()
@@ -260,6 +441,7 @@ class GLWidget(QtOpenGL.QGLWidget):
         self._settings.ratio = width/max(1,height)
 
     def mousePressEvent(self, event):
+        self._abortRefinement()
         self.lastPos = QtCore.QPoint(event.pos())
         self.lastFastmode = self._settings.fastmode
         self._settings.fastmode = True
@@ -285,10 +467,16 @@ class GLWidget(QtOpenGL.QGLWidget):
         self.do_translate = False
         self.do_zoom = False
         if param.fastmode and not self.lastFastmode:
-            param.fastmode = False
-            self.updateGL()
+            self._startRefinement()
 
     def mouseMoveEvent(self, event):
+        if self._pick_tooltips and event.buttons() == QtCore.Qt.NoButton:
+            hit = self.pick(event.x(), event.y())
+            if hit is None:
+                QtWidgets.QToolTip.hideText()
+            else:
+                QtWidgets.QToolTip.showText(event.globalPos(), self._pickToolTip(hit), self)
+            return
         dx = event.x() - self.lastPos.x()
         dy = event.y() - self.lastPos.y()
         if self.do_rotate:
@@ -307,11 +495,12 @@ class GLWidget(QtOpenGL.QGLWidget):
         if self.do_rotate_clippingplane:
             self._settings.rotateClippingNormal(dx, dy, self._settings.rotmat)
         self.lastPos = QtCore.QPoint(event.pos())
-        self.updateGL()
+        self.scheduleFrame()
 
     def wheelEvent(self, event):
+        self._abortRefinement()
         self._settings.zoom -= event.angleDelta().y()/10
-        self.updateGL()
+        self.scheduleFrame()
 
     def freeResources(self):
         self.makeCurrent()
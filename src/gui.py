@@ -274,6 +274,34 @@ not none, argument is parsed instead of command line args"""
                             help="Matplotlib writes a lot of debug log output, which we remove from the log files, set this to keep it.")
         parser.add_argument("--trace_paintGL_calls", action="store_true",
                             help="Write trace of paintGL calls to logfile")
+        parser.add_argument("--noBackgroundUpdates", action="store_true",
+                            help="Compute visualization data in the main thread instead of background threads")
+        parser.add_argument("--noLOD", action="store_true",
+                            help="Don't use decimated surfaces of large meshes while rotating/moving (fastmode)")
+        parser.add_argument("--lodLevels", type=int, action="store",
+                            help="Number of levels of decimated surfaces")
+        parser.add_argument("--lodBudget", type=int, action="store",
+                            help="Maximum number of triangles of the finest decimated surface")
+        parser.add_argument("--noMeshCache", action="store_true",
+                            help="Don't use the on-disk cache of mesh visualization data (in NGSGUI_CACHE_DIR or ~/.cache/ngsgui)")
+        parser.add_argument("--noProgramCache", action="store_true",
+                            help="Don't use the on-disk cache of compiled shader programs (in NGSGUI_CACHE_DIR or ~/.cache/ngsgui)")
+        parser.add_argument("--noShaderWarmUp", action="store_true",
+                            help="Don't compile likely needed shader variants (clipping, iso surfaces, vectors) in idle time")
+        parser.add_argument("--valuesCacheSize", type=int, action="store",
+                            help="Memory (in MB) of the cache of evaluated function values, see GUI.getValuesCacheStats (default 256, 0 disables the cache)")
+        parser.add_argument("--glDebug", action="store_true",
+                            help="Collect OpenGL debug messages (also enabled by the environment variable NGSGUI_GL_DEBUG, which additionally checks every GL call for errors)")
+        parser.add_argument("--profile", action="store_true",
+                            help="Measure GPU and CPU times of all scenes and render passes, see GUI.getFrameStats")
+        parser.add_argument("--profileOverlay", action="store_true",
+                            help="Show the GPU and CPU times of all scenes and render passes in the GL window (implies --profile)")
+        parser.add_argument("--maxFPS", type=float, action="store",
+                            help="Maximal frame rate while interacting (default 60, 0 for no limit)")
+        parser.add_argument("--tessBudget", type=float, action="store",
+                            help="GPU time of the scenes in a frame in ms, the tessellation of curved elements is coarsened to keep it (default 30, 0 for a fixed tessellation)")
+        parser.add_argument("--pickTooltips", action="store_true",
+                            help="Show element number, region and function value under the mouse cursor as tooltip")
         if not flags is None:
             self._flags = parser.parse_args(flags)
         else:
@@ -288,6 +316,38 @@ not none, argument is parsed instead of command line args"""
                 logging.getLogger("matplotlib").setLevel(logging.INFO)
             if self._flags.trace_paintGL_calls:
                 glwindow.GLWidget._trace_paintGL_calls = True
+        if not self._flags.noBackgroundUpdates:
+            from .thread import enableBackgroundTasks
+            enableBackgroundTasks()
+        from .lod import SurfaceLOD
+        SurfaceLOD.enabled = not self._flags.noLOD
+        if self._flags.lodLevels is not None:
+            SurfaceLOD.levels = self._flags.lodLevels
+        if self._flags.lodBudget is not None:
+            SurfaceLOD.budget = self._flags.lodBudget
+        if self._flags.noMeshCache:
+            from .gl_interface import MeshData
+            MeshData.disk_cache.enabled = False
+        if self._flags.noProgramCache:
+            from .gl import getProgram
+            getProgram.disk_cache.enabled = False
+        if self._flags.valuesCacheSize is not None:
+            from .gl_interface import values_cache
+            values_cache.max_size = self._flags.valuesCacheSize*1024**2
+            values_cache.enabled = self._flags.valuesCacheSize > 0
+        if self._flags.glDebug:
+            from .gl import debug_log
+            debug_log.enabled = True
+        if self._flags.profile or self._flags.profileOverlay:
+            from .profiler import profiler
+            profiler.enabled = True
+            profiler.overlay = self._flags.profileOverlay
+        if self._flags.maxFPS is not None:
+            glwindow.GLWidget._max_fps = self._flags.maxFPS
+        if self._flags.tessBudget is not None:
+            glwindow.GLWidget._tess_budget = 1e-3*self._flags.tessBudget
+        glwindow.GLWidget._pick_tooltips = self._flags.pickTooltips
+        glwindow.GLWidget._warm_up_shaders = not self._flags.noShaderWarmUp
         logger.debug("Parsed flags: {}".format(self._flags))
 
 
@@ -339,20 +399,41 @@ not none, argument is parsed instead of command line args"""
  function/constructor (in GUI.sceneCreators) to create a scene from. Scenes,
  Meshes, (most) CoefficientFunctions, (most) GridFunctions and geometries can
  be drawn by default."""
+        from .gl_interface import invalidateValues
+        invalidateValues()
         self.window_tabber.draw(*args,**kwargs)
 
+    def getFrameStats(self):
+        """Returns the GPU and CPU times (in ms, averaged over the last frames) of all scenes and their
+render passes as dictionary path -> { 'gpu', 'gpu_max', 'cpu', 'cpu_max', 'frames' }, e.g.
+'solution/clipping_plane'. Profiling must be enabled with the flag --profile."""
+        from .profiler import profiler
+        if not profiler.enabled:
+            logger.warning("Profiling is disabled, start with --profile to get frame statistics")
+        return profiler.getFrameStats()
+
+    def getValuesCacheStats(self):
+        """Returns the statistics of the cache of evaluated function values as dictionary with the
+number of 'hits', 'misses', 'evictions' and 'entries' and the 'size' and 'max_size' in bytes"""
+        from .gl_interface import values_cache
+        return values_cache.getStats()
+
     @inmain_decorator(wait_for_return=False)
     def redraw(self):
         """Redraw non-blocking. Redraw signals with a framerate higher than 50 fps are discarded, so
 another Redraw after a time loop may be needed to see the final solutions."""
         logger.debug("Call redraw")
+        from .gl_interface import invalidateValues
+        invalidateValues()
         self.window_tabber.activeGLWindow.glWidget.updateScenes()
 
     @inmain_decorator(wait_for_return=True)
     def redraw_blocking(self):
         """Draw blocking, no Redraw signals are discarded but it is a lot slower than non blocking"""
         logger.debug("Blocking redraw")
-        self.window_tabber.activeGLWindow.glWidget.updateScenes()
+        from .gl_interface import invalidateValues
+        invalidateValues()
+        self.window_tabber.activeGLWindow.glWidget.updateScenes(blocking=True)
 
     @inmain_decorator(wait_for_return=True)
     def renderToImage(self, width, height, filename=None, num_samples=16):
@@ -0,0 +1,140 @@
+"""
+Level of detail (LOD) surfaces for interactive navigation of large meshes.
+
+While the mouse is pressed (fastmode), the triangular surface elements of large meshes are drawn
+from decimated copies of the surface. The decimated surfaces are computed by vertex clustering on
+the CPU (in a background thread if background tasks are enabled) after the mesh data is uploaded.
+Each decimated triangle stores the number (within its element block) and the material index of one
+of the original triangles it replaces, so colors and solution values can still be looked up.
+"""
+
+import numpy, ngsolve
+
+class SurfaceLOD:
+    """Settings of the LOD subsystem (class attributes, can be set by command line flags)"""
+    enabled = True
+    # LOD surfaces are only built for meshes with more surface triangles than this
+    min_triangles = 2*10**5
+    # number of precomputed levels, each level has about a quarter of the triangles of the previous one
+    levels = 3
+    # maximum number of triangles in the finest level
+    budget = 5*10**5
+    # the finest level with a frame time below this is used (in seconds)
+    target_frame_time = 1.0/30
+
+    def __init__(self, levels):
+        self._levels = levels
+        self._current = 0
+
+    def __len__(self):
+        return len(self._levels)
+
+    def select(self, frame_time):
+        """Returns the elements of the level to draw. Starts with the finest level and switches to
+coarser (finer) levels if the last frame took too long (was fast enough)."""
+        if frame_time > SurfaceLOD.target_frame_time:
+            self._current = min(self._current+1, len(self._levels)-1)
+        elif frame_time < 0.25*SurfaceLOD.target_frame_time:
+            self._current = max(self._current-1, 0)
+        return self._levels[self._current]
+
+def clusterPoints(points, clusters):
+    """Mean values of the points in each cluster, clusters = (used vertices, cluster of each used vertex)
+as returned by _clusterVertices. Used to move decimated surfaces with the mesh vertices."""
+    used, cluster = clusters
+    pts = points.reshape(-1,3)[used]
+    counts = numpy.bincount(cluster)
+    new_points = numpy.empty((len(counts), 3), dtype=numpy.float32)
+    for i in range(3):
+        new_points[:,i] = numpy.bincount(cluster, weights=pts[:,i])/counts
+    return new_points
+
+def _clusterVertices(points, trigs, cell_size):
+    """Merges all vertices in one cell of a uniform grid with given cell size into their mean value.
+Returns the new points, the new triangles, for each new triangle the index of the original triangle
+it replaces and the clusters (see clusterPoints). Degenerated and duplicated triangles are removed."""
+    used, inverse = numpy.unique(trigs, return_inverse=True)
+    pts = points[used]
+    cells = numpy.floor((pts-pts.min(axis=0))/cell_size).astype(numpy.int64)
+    cells = numpy.minimum(cells, 2**21-1)
+    keys = (cells[:,0] << 42) | (cells[:,1] << 21) | cells[:,2]
+    cell_keys, cluster = numpy.unique(keys, return_inverse=True)
+    clusters = (used, cluster)
+    new_points = clusterPoints(points, clusters)
+
+    t = cluster[inverse.reshape(trigs.shape)]
+    keep = (t[:,0]!=t[:,1]) & (t[:,1]!=t[:,2]) & (t[:,0]!=t[:,2])
+    t = t[keep]
+    source = numpy.flatnonzero(keep)
+    _, first = numpy.unique(numpy.sort(t, axis=1), axis=0, return_index=True)
+    first.sort()
+    return new_points, t[first].astype(numpy.int32), source[first], clusters
+
+def _decimate(points, trigs, area, target, max_iterations=4):
+    """Vertex clustering with a cell size chosen such that the result has at most target triangles"""
+    # a surface with area A covers about A/h^2 cells of size h, with about two triangles per cell
+    h = numpy.sqrt(2*area/target)
+    for i in range(max_iterations):
+        result = _clusterVertices(points, trigs, h)
+        if len(result[1]) <= target:
+            break
+        h *= 1.1*numpy.sqrt(len(result[1])/target)
+    return result
+
+def prepareSurfaceLevels(vertices, eldata, blocks):
+    """Computes the decimated levels of the triangles in the given element blocks (CPU only, can be
+called from any thread).
+
+Parameters
+----------
+vertices : numpy array of floats
+  Vertex data of the mesh (as uploaded to the vertices texture).
+eldata : numpy array of int32
+  Element data of one VorB (as uploaded to the element texture).
+blocks : list of MeshData.ElementData
+  The element blocks of the VorB.
+
+Returns a list of levels, each one is a tuple (points, element data, [(block, offset, nelements)],
+clusters), see clusterPoints for the clusters.
+"""
+    trig_blocks = [b for b in blocks if b.type == ngsolve.ET.TRIG]
+    ntrigs = sum(b.nelements for b in trig_blocks)
+    if ntrigs < SurfaceLOD.min_triangles:
+        return []
+
+    # triangles of all trig blocks, decimated together to avoid cracks between the blocks
+    points = vertices.reshape(-1,3).astype(numpy.float64)
+    rows = [eldata[b.offset:b.offset+b.nelements*b.size].reshape(b.nelements, b.size) for b in trig_blocks]
+    trigs = numpy.concatenate([r[:,2:5] for r in rows])
+    indices = numpy.concatenate([r[:,1] for r in rows])
+    block_nrs = numpy.concatenate([numpy.full(len(r), i) for i,r in enumerate(rows)])
+    local_nrs = numpy.concatenate([numpy.arange(len(r)) for r in rows])
+
+    p = points[trigs]
+    area = 0.5*numpy.linalg.norm(numpy.cross(p[:,1]-p[:,0], p[:,2]-p[:,0]), axis=1).sum()
+
+    levels = []
+    target = SurfaceLOD.budget
+    for level in range(SurfaceLOD.levels):
+        if target >= ntrigs or target < 1:
+            break
+        new_points, new_trigs, source, clusters = _decimate(points, trigs, area, target)
+        # split the decimated triangles by their source block, rows are [nr in source block, index, v0, v1, v2]
+        parts = []
+        level_rows = []
+        offset = 0
+        for i, block in enumerate(trig_blocks):
+            sel = block_nrs[source] == i
+            n = int(sel.sum())
+            if n == 0:
+                continue
+            r = numpy.empty((n,5), dtype=numpy.int32)
+            r[:,0] = local_nrs[source[sel]]
+            r[:,1] = indices[source[sel]]
+            r[:,2:] = new_trigs[sel]
+            level_rows.append(r.ravel())
+            parts.append((block, offset, n))
+            offset += r.size
+        levels.append((new_points.ravel(), numpy.concatenate(level_rows), parts, clusters))
+        target //= 4
+    return levels
@@ -0,0 +1,196 @@
+"""
+Opt-in GPU and CPU timings of the rendered scenes and their render passes (command line flags --profile
+and --profileOverlay).
+
+Render code is wrapped in (nested) sections::
+
+    with profiler.section("clipping_plane"):
+        ...
+
+or the render function is decorated with @profiler.profiled("clipping_plane").
+
+GPU times are measured with GL_TIMESTAMP queries at the beginning and end of each section, since
+GL_TIME_ELAPSED queries can not be nested. The results are read when they are available, usually a
+few frames later, so the CPU never waits for the GPU. If profiling is disabled, section returns a
+shared no-op context manager.
+"""
+
+import time, collections, functools
+from OpenGL.GL import *
+
+class _NullSection:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_null_section = _NullSection()
+
+class _Section:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        p = self.profiler
+        p._stack.append(self.name)
+        self.path = "/".join(p._stack)
+        self.query = p._timestamp()
+        self.cpu_start = time.perf_counter()
+
+    def __exit__(self, *args):
+        p = self.profiler
+        cpu = time.perf_counter()-self.cpu_start
+        p._frame.append((self.path, self.query, p._timestamp(), cpu))
+        p._stack.pop()
+
+class _TimestampQueries:
+    """Pool of GL_TIMESTAMP queries, queries are reused when their results were read"""
+    def __init__(self):
+        self._free = []
+
+    def timestamp(self):
+        query = self._free.pop() if self._free else glGenQueries(1)[0]
+        glQueryCounter(query, GL_TIMESTAMP)
+        return query
+
+    def available(self, query):
+        return glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE)
+
+    def elapsed(self, start, end):
+        """Time in seconds between the timestamps start and end"""
+        return 1e-9*(int(glGetQueryObjectui64v(end, GL_QUERY_RESULT))-int(glGetQueryObjectui64v(start, GL_QUERY_RESULT)))
+
+    def release(self, *queries):
+        self._free += queries
+
+class GPUTimer:
+    """GPU time of a part of the frame, measured with one pair of timestamp queries independent of the
+profiler (e.g. for the tessellation budget of GLWidget). Like the profiler it never waits for the
+GPU, read returns the time of the last finished measurement."""
+    def __init__(self):
+        self._queries = _TimestampQueries()
+        self._pending = collections.deque()
+        self._start = None
+
+    def begin(self):
+        self._start = self._queries.timestamp()
+
+    def end(self):
+        self._pending.append((self._start, self._queries.timestamp()))
+        self._start = None
+
+    def read(self):
+        """Returns the GPU time in seconds of the last measurement finished since the previous call,
+None if there is none"""
+        time = None
+        while self._pending:
+            start, end = self._pending[0]
+            if not self._queries.available(end):
+                if len(self._pending) <= Profiler.max_pending:
+                    break
+            else:
+                time = self._queries.elapsed(start, end)
+            self._pending.popleft()
+            self._queries.release(start, end)
+        return time
+
+class Profiler:
+    # number of frames the statistics are computed of
+    history = 60
+    # frames with results not yet available, older ones are dropped (e.g. if queries are not supported)
+    max_pending = 10
+
+    def __init__(self):
+        self.enabled = False
+        # show the statistics in the GL window (see RenderingSettings.render)
+        self.overlay = False
+        self._stack = []
+        # sections of the current frame: (path, start query, end query, cpu time)
+        self._frame = []
+        self._pending = collections.deque()
+        self._queries = _TimestampQueries()
+        # path -> rolling per frame times in seconds
+        self._gpu = collections.defaultdict(lambda: collections.deque(maxlen=Profiler.history))
+        self._cpu = collections.defaultdict(lambda: collections.deque(maxlen=Profiler.history))
+
+    def section(self, name):
+        """Context manager measuring the enclosed rendering code, nested sections get the path
+'outer/inner'. Times of sections with the same path are summed up per frame."""
+        if not self.enabled:
+            return _null_section
+        return _Section(self, name)
+
+    def profiled(self, name):
+        """Decorator, measures all calls of the decorated function in a section name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Section(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _timestamp(self):
+        return self._queries.timestamp()
+
+    def beginFrame(self):
+        """Reads the results of previous frames which are available now"""
+        if not self.enabled:
+            return
+        while self._pending:
+            sections = self._pending[0]
+            # queries finish in order, so the last one tells if the whole frame is done
+            if sections and not self._queries.available(sections[-1][2]):
+                if len(self._pending) <= Profiler.max_pending:
+                    break
+                self._pending.popleft()
+                self._release(sections)
+                continue
+            self._pending.popleft()
+            gpu = collections.Counter()
+            cpu = collections.Counter()
+            for path, start, end, cpu_time in sections:
+                gpu[path] += self._queries.elapsed(start, end)
+                cpu[path] += cpu_time
+            for path in gpu:
+                self._gpu[path].append(gpu[path])
+                self._cpu[path].append(cpu[path])
+            self._release(sections)
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+        self._pending.append(self._frame)
+        self._frame = []
+
+    def _release(self, sections):
+        for path, start, end, cpu_time in sections:
+            self._queries.release(start, end)
+
+    def getFrameStats(self):
+        """Returns a dictionary path -> { 'gpu' : ..., 'gpu_max' : ..., 'cpu' : ..., 'cpu_max' : ...,
+'frames' : ... } with the average and maximal time in milliseconds per frame over the last (up to)
+Profiler.history frames"""
+        stats = {}
+        for path in sorted(self._gpu):
+            gpu, cpu = self._gpu[path], self._cpu[path]
+            stats[path] = { 'gpu' : 1e3*sum(gpu)/len(gpu), 'gpu_max' : 1e3*max(gpu),
+                            'cpu' : 1e3*sum(cpu)/len(cpu), 'cpu_max' : 1e3*max(cpu),
+                            'frames' : len(gpu) }
+        return stats
+
+    def reset(self):
+        self._gpu.clear()
+        self._cpu.clear()
+
+    def getOverlayLines(self):
+        """Statistics as text lines for the overlay in the GL window"""
+        lines = ["{:<40} GPU {:7.2f} ms  CPU {:7.2f} ms".format(path, s['gpu'], s['cpu'])
+                 for path, s in self.getFrameStats().items()]
+        return lines
+
+profiler = Profiler()
@@ -1,14 +1,16 @@
 
-import numpy, os, ngsolve
+import numpy, os, sys, ngsolve
 
-from .gl import Texture, getProgram, ArrayBuffer, VertexArray, TextRenderer, Query
+from .gl import Texture, getProgram, ArrayBuffer, VertexArray, TextRenderer, Query, TransformFeedback, FeedbackBuffer, beginFrame, gl_state
 from . import widgets as wid
 from .widgets import ArrangeH, ArrangeV
 from . import glmath
 import math, cmath
-from .thread import inmain_decorator, inthread
-from .gl_interface import getOpenGLData, getReferenceRules, MeshData
+from .thread import inmain_decorator, inthread, BackgroundTask
+from .gl_interface import getOpenGLData, prepareOpenGLData, getReferenceRules, MeshData, getValuesKey, lookupValues, storeValues
 from .gui import GUI
+from .profiler import profiler
+from .bvh import intersectRanges
 import netgen.meshing, netgen.geom2d
 from . import settings
 
@@ -84,6 +86,16 @@ name : str = type(self).__name__ + scene_counter
         """Render scene, must be overloaded by derived class"""
         pass
 
+    def waitForUpdate(self):
+        """Blocks until data computed in the background by update is ready"""
+        pass
+
+    def getWarmUpPrograms(self):
+        """Returns a list of (shader files, getProgram keyword arguments) of shader variants which are
+likely needed later (e.g. when clipping is enabled). They are compiled in idle time after the scene
+was updated, see GLWidget.warmUpShaders."""
+        return []
+
     def deferRendering(self):
         """used to render some scenes later (eg. overlays, transparency)
         the higher the return value, the later it will be rendered"""
@@ -132,7 +144,7 @@ center of this box. Rotation will be around this center."""
 
     def _updateGL(self):
         if self.window:
-            self.window().glWidget.updateGL()
+            self.window().glWidget.scheduleFrame()
 
     def _attachParameter(self, parameter):
         super()._attachParameter(parameter)
@@ -164,6 +176,12 @@ name : str = "action" + consecutive number
     def doubleClickAction(self,point):
         if self._actions:
             self._actions[self.getAction()](point)
+
+    def pick(self, settings, origin, direction):
+        """Returns information about the object hit by the ray origin + t*direction (in model
+coordinates) as a dict or None, see BaseMeshScene.pick"""
+        return None
+
     def getOrder(self):
         return self._global_rendering_parameters.getOrder()
     def setOrder(self, value):
@@ -237,9 +255,14 @@ class RenderingSettings(BaseScene, settings.CameraSettings, settings.LightSettin
             points = [self._cross_shift + (self._cross_scale if i%7==3 else 0) for i in range(24)]
             self._cross_points.store(numpy.array(points, dtype=numpy.float32))
 
+    def beginFrame(self):
+        """Updates the per frame values shared by all programs (camera, see gl.beginFrame), called once
+per frame before the scenes are rendered"""
+        beginFrame(self)
+
     def render(self, rp):
         with self._vao:
-            glDisable(GL_DEPTH_TEST)
+            gl_state.disable(GL_DEPTH_TEST)
             if self.getShowCross():
                 prog = getProgram("cross.vert", "cross.frag")
                 model, view, projection = self.model, self.view, self.projection
@@ -256,7 +279,7 @@ class RenderingSettings(BaseScene, settings.CameraSettings, settings.LightSettin
                     for j in range(4):
                         coords[i,j] = coords[i,j]/coords[3,j]
 
-                glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
+                gl_state.polygonMode(GL_FILL)
                 glDrawArrays(GL_LINES, 0,6)
                 for i in range(3):
                     self._text_renderer.draw(self, "xyz"[i], coords[0:3,i], alignment=QtCore.Qt.AlignCenter|QtCore.Qt.AlignVCenter)
@@ -272,7 +295,7 @@ class RenderingSettings(BaseScene, settings.CameraSettings, settings.LightSettin
                 uniforms.set('y0', y0)
                 uniforms.set('dy', dy)
 
-                glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+                gl_state.polygonMode(GL_FILL)
                 glDrawArrays(GL_TRIANGLES, 0, 6)
                 cmin = self.getColormapMin()
                 cmax = self.getColormapMax()
@@ -280,7 +303,68 @@ class RenderingSettings(BaseScene, settings.CameraSettings, settings.LightSettin
                     x = x0+i*dx/4
                     val = cmin + i*(cmax-cmin)/4
                     self._text_renderer.draw(self, '{:.2g}'.format(val).replace("e+", "e"), [x,y0-0.03,0], alignment=QtCore.Qt.AlignCenter|QtCore.Qt.AlignTop)
-            glEnable(GL_DEPTH_TEST)
+            if profiler.overlay:
+                for i, line in enumerate(profiler.getOverlayLines()):
+                    self._text_renderer.draw(self, line, [-0.99,0.9-0.05*i,0], alignment=QtCore.Qt.AlignLeft|QtCore.Qt.AlignTop)
+            gl_state.enable(GL_DEPTH_TEST)
+
+def _getTessLevel(settings, elements):
+    """Maximal tessellation level of curved elements (see mesh.tesc). Large element blocks are drawn with
+level 1 in fastmode and with at most settings.tess_level while the frame is refined progressively after
+interaction (see GLWidget._startRefinement)."""
+    if elements.nelements <= 10**4:
+        return 10
+    if settings.fastmode:
+        return 1
+    return settings.tess_level
+
+def _setTessellation(uniforms, settings, elements):
+    """Sets the uniforms of mesh.tesc, which chooses the tessellation level of each patch from its size
+on the screen, bounded by _getTessLevel"""
+    uniforms.set('max_tess_level', float(_getTessLevel(settings, elements)))
+    uniforms.set('tess_tolerance', float(settings.tess_tolerance))
+    uniforms.set('viewport_size', settings.viewport_size)
+
+def _drawParts(blocks):
+    """The parts of the element blocks to draw, curved blocks are split into their (nearly) straight and
+their curved elements (see MeshData.ElementData.parts)"""
+    return [part for block in blocks for part in block.parts]
+
+def _drawElements(mode, nverts, elements, ranges=None, uniforms=None, instances=None):
+    """Draws the elements of a block with nverts vertices per element. ranges are arrays (first, count)
+of element ranges (see BaseMeshScene._getVisibleRanges), by default the ranges of the block (all its
+elements if it is not a part of a curved block) are drawn. All ranges are drawn with one glMultiDrawArrays,
+instances (faces of the elements) with one glMultiDrawArrays per instance if there are more ranges than
+instances and the program has the uniform instance_offset. Only on MacOS the patches are drawn range by
+range, the number of the first element is passed to mesh.tesc/mesh.tese there, since gl_PrimitiveID
+restarts at 0 for each draw call."""
+    if ranges is None:
+        ranges = elements.ranges
+    if ranges is None:
+        first, count = numpy.array([0]), numpy.array([elements.nelements])
+    else:
+        first, count = ranges
+    if len(first) == 0:
+        return
+    if mode == GL_PATCHES and 'darwin' in sys.platform:
+        for f, c in zip(first, count):
+            uniforms.set('primitive_offset', int(f))
+            glDrawArrays(mode, nverts*int(f), nverts*int(c))
+    elif instances is not None:
+        if len(first) > instances and uniforms is not None and 'instance_offset' in uniforms:
+            first, count = (nverts*first).astype(numpy.int32), (nverts*count).astype(numpy.int32)
+            for i in range(instances):
+                uniforms.set('instance_offset', i)
+                glMultiDrawArrays(mode, first, count, len(first))
+        else:
+            if uniforms is not None and 'instance_offset' in uniforms:
+                uniforms.set('instance_offset', 0)
+            for f, c in zip(first, count):
+                glDrawArraysInstanced(mode, nverts*int(f), nverts*int(c), instances)
+    elif len(first) == 1:
+        glDrawArrays(mode, nverts*int(first[0]), nverts*int(count[0]))
+    else:
+        glMultiDrawArrays(mode, (nverts*first).astype(numpy.int32), (nverts*count).astype(numpy.int32), len(first))
 
 class BaseMeshScene(BaseScene):
     """Base class for all scenes that depend on a mesh"""
@@ -319,6 +403,8 @@ class BaseMeshScene(BaseScene):
         super().initGL()
         if self.deformation:
             self._deformation_values = { 'real':{} }
+        # incremented each time new mesh data or function values are uploaded
+        self._data_version = 0
 
     @inmain_decorator(True)
     def update(self, mesh=None, deformation=None):
@@ -327,11 +413,36 @@ class BaseMeshScene(BaseScene):
         if deformation:
             self.deformation = deformation
         super().update()
+        if not hasattr(self, "_update_task"):
+            self._update_task = BackgroundTask(self._prepareUpdate, self._finishUpdate)
+        # the first update is done synchronously, afterwards the old data is rendered until the new
+        # data is computed in the background
+        self._update_task.start(self.getSubdivision(), self.getOrder(), blocking=not hasattr(self, "mesh_data"))
+
+    def waitForUpdate(self):
+        if hasattr(self, "_update_task"):
+            self._update_task.wait()
+
+    def _prepareUpdate(self, sd, order):
+        """CPU part of update, runs in a worker thread if background tasks are enabled. Returns a list of
+functions which upload the data to the GPU, the first one returns the mesh data."""
+        uploads = [prepareOpenGLData(self.mesh)]
+        if self.deformation:
+            vb = ngsolve.BND if self.mesh.dim==3 else ngsolve.VOL
+            uploads.append(self._prepareValues(self.deformation, vb, sd, order, self._deformation_values))
+        return uploads
+
+    def _finishUpdate(self, uploads):
+        if self.window:
+            self.window().glWidget.makeCurrent()
         with self._vao:
-            self.mesh_data = getOpenGLData(self.mesh)
-            if self.deformation:
-                vb = ngsolve.BND if self.mesh.dim==3 else ngsolve.VOL
-                self._getValues(self.deformation, vb, self.getSubdivision(), self.getOrder(), self._deformation_values )
+            self.mesh_data = uploads[0]()
+            for upload in uploads[1:]:
+                upload()
+        self._data_version += 1
+        if self.window:
+            self.window().glWidget.update()
+            self.window().glWidget.warmUpShaders()
 
     def __getstate__(self):
         super_state = super().__getstate__()
@@ -349,33 +460,88 @@ class BaseMeshScene(BaseScene):
     def getDeformation(self):
         return False
 
+    def _getVisibleRanges(self, settings, elements):
+        """Ranges (first, count) of elements in the block which are possibly visible (inside the view
+frustum and not clipped away), None if the whole block must be drawn"""
+        if elements.bvh is None or self.getDeformation():
+            return elements.ranges
+        mvp = settings.projection*settings.view*settings.model
+        m = numpy.array([[mvp[i,j] for j in range(4)] for i in range(4)])
+        # frustum planes in model coordinates: -w <= x,y,z <= w in clip space
+        planes = [m[3]+m[i] for i in range(3)] + [m[3]-m[i] for i in range(3)]
+        ranges = elements.bvh.visibleRanges(planes + self._getClippingHalfSpaces())
+        if elements.ranges is not None:
+            ranges = intersectRanges(ranges, elements.ranges)
+        return ranges
+
+    def _getClippingHalfSpaces(self):
+        """Planes of the clipping, the visible part is in their positive half spaces (only for a single
+clipping plane, otherwise an empty list is returned)"""
+        if self.getClippingEnable() and self.getClippingExpression() == 'p[0]':
+            # only the negative side of the clipping plane is drawn
+            return [-numpy.array(self.getClippingPlanes()[:4])]
+        return []
+
+    def pick(self, settings, origin, direction):
+        """Returns the surface element hit by the ray origin + t*direction (in model coordinates) as a
+dict with the keys 'element' (ngsolve.ElementId), 'region' (material or boundary name), 'point',
+'local' (local coordinates on the element) and 'distance' (t), or None. Runs on the CPU only, curved
+elements are picked on their straight geometry."""
+        if not self.active or not hasattr(self, "mesh_data") or self.getDeformation():
+            return None
+        vb = ngsolve.VOL if self.mesh.dim==2 else ngsolve.BND
+        hit = self.mesh_data.pick(vb, origin, direction, self._getClippingHalfSpaces())
+        if hit is None:
+            return None
+        regions = self.mesh.GetMaterials() if vb == ngsolve.VOL else self.mesh.GetBoundaries()
+        hit['scene'] = self
+        hit['element'] = ngsolve.ElementId(vb, hit['nr'])
+        hit['region'] = regions[hit['index']]
+        return hit
+
     # evaluate given CoefficientFunction and store results in vals (a dictionary with special structure)
     def _getValues(self, cf, vb, sd, order, vals, covariant=False):
-        formats = [None, GL_R32F, GL_RG32F, GL_RGB32F, GL_RGBA32F];
-        if vb not in vals:
-            vals[vb] = {'real':{}, 'imag':{}}
-        try:
-            irs = getReferenceRules(order, 2**sd-1)
-            if isinstance(vb, str) and vb == "facet":
-                values = ngsolve.solve._GetFacetValues(cf, self.mesh, irs)
-            else:
-                values = ngsolve.solve._GetValues(cf, self.mesh, vb, irs, covariant)
-            vals = vals[vb]
-            vals['min'] = values['min']
-            vals['max'] = values['max']
+        return self._prepareValues(cf, vb, sd, order, vals, covariant)()
+
+    # evaluate given CoefficientFunction (without using OpenGL, so it can be done in a worker thread),
+    # returns a function that stores the results in vals, it must be called in the main thread
+    def _prepareValues(self, cf, vb, sd, order, vals, covariant=False):
+        # values of GridFunctions are cached until their vector changes, of other functions until the next
+        # Draw or Redraw, e.g. for switching the order or subdivision back and forth
+        key = getValuesKey(cf, self.mesh, vb, order, sd, covariant)
+        values = lookupValues(key, cf, self.mesh) if key is not None else None
+        if values is None:
+            try:
+                irs = getReferenceRules(order, 2**sd-1)
+                if isinstance(vb, str) and vb == "facet":
+                    values = ngsolve.solve._GetFacetValues(cf, self.mesh, irs)
+                else:
+                    values = ngsolve.solve._GetValues(cf, self.mesh, vb, irs, covariant)
+            except RuntimeError as e:
+                assert("Local Heap" in str(e))
+                def reduceSubdivision():
+                    self.setSubdivision(sd-1)
+                    print("Localheap overflow, cannot increase subdivision!")
+                return reduceSubdivision
+            if key is not None:
+                storeValues(key, cf, self.mesh, values)
+
+        def upload():
+            formats = [None, GL_R32F, GL_RG32F, GL_RGB32F, GL_RGBA32F];
+            if vb not in vals:
+                vals[vb] = {'real':{}, 'imag':{}}
+            vbvals = vals[vb]
+            vbvals['min'] = values['min']
+            vbvals['max'] = values['max']
             comps = ['real']
             if cf.is_complex: comps.append('imag')
             for comp in comps:
                 for et in values[comp]:
-                    if not et in vals[comp]:
-                        vals[comp][et] = Texture(GL_TEXTURE_BUFFER, formats[cf.dim])
-                    vals[comp][et].store(values[comp][et])
-        except RuntimeError as e:
-            assert("Local Heap" in str(e))
-            self.setSubdivision(self.getSubdivision()-1)
-            print("Localheap overflow, cannot increase subdivision!")
-
-        return values
+                    if not et in vbvals[comp]:
+                        vbvals[comp][et] = Texture(GL_TEXTURE_BUFFER, formats[cf.dim])
+                    vbvals[comp][et].store(values[comp][et])
+            return values
+        return upload
 
 
 class MeshScene(BaseMeshScene):
@@ -537,45 +703,43 @@ class MeshScene(BaseMeshScene):
         self.tex_vol_filter.store(numpy.array(values, dtype=numpy.float32), data_format=GL_FLOAT)
 
 
+    @profiler.profiled("edges")
     def _render1DElements(self, settings, elements):
         use_deformation = self.getDeformation()
         use_tessellation = elements.curved or use_deformation
         if use_tessellation:
-            prog = getProgram('mesh.vert', 'mesh.tese', 'mesh.frag', elements=elements, params=settings, DEFORMATION=use_deformation, scene=self)
+            prog = getProgram('mesh.vert', 'mesh.tesc', 'mesh.tese', 'mesh.frag', elements=elements, params=settings, DEFORMATION=use_deformation, scene=self)
         else:
             prog = getProgram('mesh.vert', 'mesh.frag', elements=elements, params=settings, DEFORMATION=False, scene=self)
         uniforms = prog.uniforms
 
-        glActiveTexture(GL_TEXTURE3)
-        self.tex_edge_colors.bind()
+        self.tex_edge_colors.bind(3)
         uniforms.set('colors', 3)
 
         uniforms.set('mesh.dim', 1);
+        ranges = self._getVisibleRanges(settings, elements)
         uniforms.set('light.ambient', 1.0)
         uniforms.set('light.diffuse', 0.0)
         uniforms.set('wireframe', True)
-        tess_level = 10
-        if settings.fastmode and elements.nelements>10**4:
-            tess_level=1
         if elements.curved:
+            _setTessellation(uniforms, settings, elements)
             glPatchParameteri(GL_PATCH_VERTICES, 2)
-            glPatchParameterfv(GL_PATCH_DEFAULT_OUTER_LEVEL, [1,tess_level])
-            glPatchParameterfv(GL_PATCH_DEFAULT_INNER_LEVEL, [1]*2)
-            glDrawArrays(GL_PATCHES, 0, 2*elements.nelements)
+            _drawElements(GL_PATCHES, 2, elements, ranges, uniforms)
         else:
-            glDrawArrays(GL_LINES, 0, 2*elements.nelements)
+            _drawElements(GL_LINES, 2, elements, ranges)
 
     def renderEdges(self, settings):
         els = []
 
 
+    @profiler.profiled("surface")
     def _render2DElements(self, settings, elements, wireframe):
         use_deformation = self.getDeformation()
         use_tessellation = elements.curved or use_deformation
         shader = ['mesh.vert', 'mesh.frag']
         options = {}
         if use_tessellation:
-            shader.append('mesh.tese')
+            shader += ['mesh.tesc', 'mesh.tese']
         prog = getProgram(*shader, elements=elements, params=settings, DEFORMATION=use_deformation, scene=self, **options)
         uniforms = prog.uniforms
 
@@ -590,8 +754,7 @@ class MeshScene(BaseMeshScene):
 #             uniforms.set('deformation.order', self.getOrder())
 #             uniforms.set('deformation_scale', self.getDeformationScale())
 
-        glActiveTexture(GL_TEXTURE3)
-        self.tex_surf_colors.bind()
+        self.tex_surf_colors.bind(3)
         uniforms.set('colors', 3)
 
         uniforms.set('mesh.dim', 2);
@@ -608,25 +771,22 @@ class MeshScene(BaseMeshScene):
             polygon_mode = GL_FILL
             offset = 1
 
-        tess_level = 10
-        if settings.fastmode and elements.nelements>10**4:
-            tess_level=1
-
-        glPolygonMode( GL_FRONT_AND_BACK, polygon_mode );
-        glPolygonOffset (offset, offset)
-        glEnable(offset_mode)
+        gl_state.polygonMode(polygon_mode)
+        gl_state.polygonOffset(offset, offset)
+        gl_state.enable(offset_mode)
+        ranges = self._getVisibleRanges(settings, elements)
         if use_tessellation:
+            _setTessellation(uniforms, settings, elements)
             glPatchParameteri(GL_PATCH_VERTICES, elements.nverts)
-            glPatchParameterfv(GL_PATCH_DEFAULT_OUTER_LEVEL, [tess_level]*4)
-            glPatchParameterfv(GL_PATCH_DEFAULT_INNER_LEVEL, [tess_level]*2)
-            glDrawArrays(GL_PATCHES, 0, elements.nverts*elements.nelements)
+            _drawElements(GL_PATCHES, elements.nverts, elements, ranges, uniforms)
         else:
             if elements.nverts==3:
-                glDrawArrays(GL_TRIANGLES, 0, 3*elements.nelements)
+                _drawElements(GL_TRIANGLES, 3, elements, ranges)
             if elements.nverts==4:
-                glDrawArraysInstanced(GL_TRIANGLES, 0, 3*elements.nelements, 2)
-        glDisable(offset_mode)
+                _drawElements(GL_TRIANGLES, 3, elements, ranges, uniforms, instances=2)
+        gl_state.disable(offset_mode)
 
+    @profiler.profiled("volume_elements")
     def _render3DElements(self, settings, elements):
 #         if elements.type == ngsolve.PRISM:
 #             return
@@ -641,20 +801,17 @@ class MeshScene(BaseMeshScene):
         uniforms.set('shrink_elements', self.getShrink())
         uniforms.set('clip_whole_elements', True)
 
-        glActiveTexture(GL_TEXTURE3)
-
         uniforms.set('color_by_element_type', self.getColorByElType())
         if self.getColorByElType():
-            self.tex_eltype_colors.bind()
+            self.tex_eltype_colors.bind(3)
         else:
-            self.tex_vol_colors.bind()
+            self.tex_vol_colors.bind(3)
 
         uniforms.set('colors', 3)
 
         if self.getFilterElements():
             uniforms.set('filter_elements', True)
-            glActiveTexture(GL_TEXTURE4)
-            self.tex_vol_filter.bind()
+            self.tex_vol_filter.bind(4)
             uniforms.set('tex_filter', 4)
             uniforms.set('filter_min', self.getFilterMin())
             uniforms.set('filter_max', self.getFilterMax())
@@ -663,9 +820,11 @@ class MeshScene(BaseMeshScene):
 
         uniforms.set('light.ambient', 0.3)
         uniforms.set('light.diffuse', 0.7)
-        glPolygonMode( GL_FRONT_AND_BACK, GL_FILL )
-        glDrawArraysInstanced(GL_TRIANGLES, 0, 3*elements.nelements, elements.n_instances_2d)
+        gl_state.polygonMode(GL_FILL)
+        ranges = self._getVisibleRanges(settings, elements)
+        _drawElements(GL_TRIANGLES, 3, elements, ranges, uniforms, instances=elements.n_instances_2d)
 
+    @profiler.profiled("numbers")
     def _renderNumbers(self, settings, elements):
         prog = getProgram('pass_through.vert', 'numbers.geom', 'font.frag', params=settings, elements=elements, scene=self, USE_GL_VERTEX_ID=True)
         uniforms = prog.uniforms
@@ -679,8 +838,7 @@ class MeshScene(BaseMeshScene):
             self.text_renderer.addFont(font_size)
         font = self.text_renderer.fonts[font_size]
 
-        glActiveTexture(GL_TEXTURE2)
-        font.tex.bind()
+        font.tex.bind(2)
         uniforms.set('font', 2)
 
         uniforms.set('font_width_in_texture', font.width/font.tex_width)
@@ -690,8 +848,8 @@ class MeshScene(BaseMeshScene):
 
         uniforms.set('font_color', [0,0,0,1])
 
-        glPolygonMode( GL_FRONT_AND_BACK, GL_FILL )
-        glPolygonOffset (0,0)
+        gl_state.polygonMode(GL_FILL)
+        gl_state.polygonOffset(0, 0)
         glDrawArrays(GL_POINTS, 0, elements.nelements)
 
     def render(self, settings):
@@ -702,24 +860,28 @@ class MeshScene(BaseMeshScene):
             dim = self.mesh.dim
             # 1D elements
             if self.mesh.dim > 2 and self.getShowEdges():
-                for els in self.mesh_data.elements["edges"]:
+                for els in _drawParts(self.mesh_data.elements["edges"]):
                     self._render1DElements(settings, els);
             if self.getShowEdgeElements():
                 vb = vbs[dim-1]
-                for els in self.mesh_data.elements[vb]:
+                for els in _drawParts(self.mesh_data.elements[vb]):
                     if vb in [ngsolve.BBND, ngsolve.BND]:
                         # glLineWidth(3) # TODO: replace with manually drawing quads (linewidth is not supported for OpenGL3.2
                         self._render1DElements(settings, els);
                         # glLineWidth(1)
 
             if self.getShowPeriodicVertices():
-                for els in self.mesh_data.elements["periodic"]:
+                for els in _drawParts(self.mesh_data.elements["periodic"]):
                     self._render1DElements(settings, els);
 
             # 2D elements
             if self.mesh.dim > 1:
                 vb = vbs[dim-2]
-                for els in self.mesh_data.elements[vb]:
+                if settings.fastmode and not self.getDeformation():
+                    element_blocks = self.mesh_data.getLODElements(vb, settings.frame_time)
+                else:
+                    element_blocks = self.mesh_data.elements[vb]
+                for els in _drawParts(element_blocks):
                     if self.getShowSurface():
                         self._render2DElements(settings, els, False);
                     if self.getShowWireframe():
@@ -923,10 +1085,64 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
 
         formats = [None, GL_R32F, GL_RG32F, GL_RGB32F, GL_RGBA32F];
 
-        self.filter_buffer = ArrayBuffer()
-        self.filter_buffer.bind()
-        glBufferData(GL_ARRAY_BUFFER, 100000000, ctypes.c_void_p(), GL_STATIC_DRAW)
+        # output of the transform feedback passes per pass and element block, see _runFeedbackPass
+        self._feedbacks = {}
+
+    def _clippingKey(self):
+        """All settings which change the result of CalcClipping in shaders"""
+        return (self.getClippingEnable(), tuple(self.getClippingPlanes()), self.getClippingExpression(),
+                tuple(self.getClippingSphereCenter()), self.getClippingSphereRadius())
+
+    def _runFeedbackPass(self, name, elements, key, stride, estimate, setup, draw, count=True):
+        """Runs the transform feedback pass name for an element block: setup() binds the program and sets
+the uniforms, draw() writes records of stride bytes into the output buffer. The output is cached, the
+pass only runs again if the mesh data, function values or key (all other inputs of the pass) change.
+
+The buffer of the pass is allocated lazily for estimate records. If count is set, the number of
+generated records is queried without waiting for the GPU. The result is checked later (see
+_checkFeedbackOverflow), if the output did not fit into the buffer, it is enlarged and the scene is
+redrawn. Returns the transform feedback object to draw the output and the output buffer."""
+        entry = self._feedbacks.get((name, elements.key))
+        if entry is None:
+            entry = { 'feedback' : TransformFeedback(), 'buffer' : FeedbackBuffer(), 'key' : None, 'query' : None }
+            self._feedbacks[(name, elements.key)] = entry
+        key = (self._data_version, self.getSubdivision(), self.getOrder()) + tuple(key)
+        feedback, buffer = entry['feedback'], entry['buffer']
+        if entry['key'] == key:
+            return feedback, buffer
+
+        setup()
+        gl_state.enable(GL_RASTERIZER_DISCARD)
+        buffer.reserve(stride*estimate)
+        feedback.bind(buffer)
+        glBeginTransformFeedback(GL_POINTS)
+        if count and entry['query'] is None:
+            entry['query'] = Query(GL_PRIMITIVES_GENERATED, wait=False)
+            with entry['query']:
+                draw()
+            QtCore.QTimer.singleShot(0, lambda: self._checkFeedbackOverflow(entry, stride))
+        else:
+            draw()
+        glEndTransformFeedback()
+        gl_state.disable(GL_RASTERIZER_DISCARD)
+        entry['key'] = key
+        return feedback, buffer
 
+    def _checkFeedbackOverflow(self, entry, stride):
+        if self.window:
+            self.window().glWidget.makeCurrent()
+        query = entry['query']
+        if not query.available():
+            QtCore.QTimer.singleShot(10, lambda: self._checkFeedbackOverflow(entry, stride))
+            return
+        generated = query.result()
+        query.delete()
+        entry['query'] = None
+        if stride*generated > entry['buffer'].size:
+            entry['buffer'].reserve(stride*generated)
+            entry['key'] = None
+            if self.window:
+                self.window().glWidget.update()
 
     def objectsToUpdate(self):
         return [self.cf, self.iso_surface] + super().objectsToUpdate()
@@ -938,40 +1154,83 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
         if iso_surface:
             self.iso_surface = iso_surface
         super().update(*args)
-        self._getValues(self.cf, ngsolve.VOL, self.getSubdivision(), self.getOrder(), self.values)
+
+    def _prepareUpdate(self, sd, order):
+        uploads = super()._prepareUpdate(sd, order)
+        uploads.append(self._prepareValues(self.cf, ngsolve.VOL, sd, order, self.values))
         if self.mesh.dim==3:
             try:
-                self._getValues(self.cf, ngsolve.BND, self.getSubdivision(), self.getOrder(), self.values)
+                uploads.append(self._prepareValues(self.cf, ngsolve.BND, sd, order, self.values))
             except Exception as e:
                 print("Cannot evaluate given function on surface elements"+str(e))
         if self.iso_surface is self.cf:
-            self.iso_values = self.values
+            uploads.append(lambda: setattr(self, "iso_values", self.values))
         else:
-            self._getValues(self.iso_surface, ngsolve.VOL, self.getSubdivision(), self.getOrder(), self.iso_values)
-        # self._getValues(self.cf, ngsolve.VOL, self.getSubdivision(), self.getOrder(), self.fieldline_values, covariant=True)
+            uploads.append(self._prepareValues(self.iso_surface, ngsolve.VOL, sd, order, self.iso_values))
+        # uploads.append(self._prepareValues(self.cf, ngsolve.VOL, sd, order, self.fieldline_values, covariant=True))
+        return uploads
+
+    def pick(self, settings, origin, direction):
+        """See BaseMeshScene.pick, additionally returns the function value at the hit point as 'value'
+(None if the point is not found in the mesh)"""
+        hit = super().pick(settings, origin, direction)
+        if hit is not None:
+            try:
+                hit['value'] = self.cf(self.mesh(*hit['point']))
+            except Exception:
+                hit['value'] = None
+        return hit
 
 
-    def _filterElements(self, settings, elements, filter_type):
-        glEnable(GL_RASTERIZER_DISCARD)
-        prog = getProgram('pass_through.vert', 'filter_elements.geom', feedback=['element'], params=settings, elements=elements, USE_GL_VERTEX_ID=True, scene=self, CLIPPING=1)
-        uniforms = prog.uniforms
+    def getWarmUpPrograms(self):
+        programs = []
+        vb = ngsolve.VOL if self.mesh.dim==2 else ngsolve.BND
+        use_deformation = self.getDeformation()
+        # surfaces with enabled clipping
+        for elements in _drawParts(self.mesh_data.elements[vb]):
+            shader = ['mesh.vert', 'solution.frag']
+            if use_deformation or elements.curved:
+                shader += ['mesh.tesc', 'mesh.tese']
+            programs.append((shader, dict(elements=elements, DEFORMATION=use_deformation, CLIPPING=1)))
 
-        if filter_type == 1: # iso surface
-            prog.setFunction(self, elements, values=self.iso_values[ngsolve.VOL])
-            uniforms.set('iso_value', self.getIsoValue())
+        if self.mesh.dim > 2:
+            for elements in self.mesh_data.elements[ngsolve.VOL]:
+                # clipping plane and iso surface
+                programs.append((['pass_through.vert', 'filter_elements.geom'],
+                                 dict(elements=elements, feedback=['element'], USE_GL_VERTEX_ID=True, CLIPPING=1)))
+                programs.append((['pass_through.vert', 'clipping.geom', 'solution.frag'],
+                                 dict(elements=elements, CLIPPING=1, SKIP_FRAGMENT_CLIPPING=1)))
+                programs.append((['pass_through.vert', 'isosurface.geom', 'solution.frag'],
+                                 dict(elements=elements, USE_INSTANCE_ID=True)))
+                if self.cf.dim > 1:
+                    for mode in ['VOLUME_GRID', 'CLIPPING_PLANE_GRID']:
+                        programs.append((['pass_through.vert', 'vectors_filter.geom'],
+                                         dict(elements=elements, feedback=['pos','val'], USE_GL_VERTEX_ID=True, FILTER_MODE=mode, CLIPPING=1)))
+                    programs.append((['vectors.vert', 'vectors_draw.geom', 'vectors.frag'], dict(elements=elements)))
+        return programs
 
-        uniforms.set('filter_type', filter_type)
+    def _filterElements(self, settings, elements, filter_type):
+        """Returns the transform feedback object and buffer with the numbers of all elements cutting the
+clipping plane (filter_type 0) or iso surface (filter_type 1)"""
+        def setup():
+            prog = getProgram('pass_through.vert', 'filter_elements.geom', feedback=['element'], params=settings, elements=elements, USE_GL_VERTEX_ID=True, scene=self, CLIPPING=1)
+            uniforms = prog.uniforms
 
-        self.filter_feedback = glGenTransformFeedbacks(1)
-        glBindTransformFeedback(GL_TRANSFORM_FEEDBACK, self.filter_feedback)
-        glBindBufferBase(GL_TRANSFORM_FEEDBACK_BUFFER, 0, self.filter_buffer.id)
-        glBeginTransformFeedback(GL_POINTS)
+            if filter_type == 1: # iso surface
+                prog.setFunction(self, elements, values=self.iso_values[ngsolve.VOL])
+                uniforms.set('iso_value', self.getIsoValue())
 
-        glDrawArrays(GL_POINTS, 0, elements.nelements)
+            uniforms.set('filter_type', filter_type)
 
-        glEndTransformFeedback()
-        glDisable(GL_RASTERIZER_DISCARD)
+        if filter_type == 1:
+            key = (filter_type, self.getIsoValue(), self.getComponent() if self.cf.dim > 1 else 0)
+        else:
+            key = (filter_type, self._clippingKey())
+        # at most one element number (4 bytes) per element
+        return self._runFeedbackPass('filter{}'.format(filter_type), elements, key, 4, elements.nelements, setup,
+                                     lambda: glDrawArrays(GL_POINTS, 0, elements.nelements), count=False)
 
+    @profiler.profiled("surface")
     def _render1D(self, settings, elements):
         # use actual function values for deformation on 1d meshes
         use_deformation = self.getDeformation()
@@ -981,7 +1240,7 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
 
         shader = ['mesh.vert', 'solution.frag']
         if use_tessellation:
-            shader.append('mesh.tese')
+            shader += ['mesh.tesc', 'mesh.tese']
 
         prog = getProgram(*shader, elements=elements, params=settings, scene=self, **options)
         prog.setFunction(self, elements)
@@ -990,40 +1249,41 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
         uniforms.set('wireframe', False)
 
         if use_deformation:
-            glActiveTexture(GL_TEXTURE4)
-            self._deformation_values[ngsolve.VOL]['real'][(elements.type, elements.curved)].bind()
+            self._deformation_values[ngsolve.VOL]['real'][elements.key].bind(4)
             uniforms.set('deformation.coefficients', 4)
             uniforms.set('deformation.subdivision', 2**self.getSubdivision()-1)
             uniforms.set('deformation.order', self.getOrder())
             uniforms.set('deformation_scale', self.getDeformationScale())
 
-        tess_level = 10
-        if settings.fastmode and elements.nelements>10**4:
-            tess_level=1
-
         nverts = elements.nverts
         nelements = elements.nelements
-        glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+        gl_state.polygonMode(GL_FILL)
         if use_tessellation:
+            _setTessellation(uniforms, settings, elements)
             glPatchParameteri(GL_PATCH_VERTICES, nverts)
-            glPatchParameterfv(GL_PATCH_DEFAULT_OUTER_LEVEL, [1,tess_level,1,1])
-            glPatchParameterfv(GL_PATCH_DEFAULT_INNER_LEVEL, [1,1])
-            glDrawArrays(GL_PATCHES, 0, nverts*nelements)
+            _drawElements(GL_PATCHES, nverts, elements, uniforms=uniforms)
         else:
-            glDrawArrays(GL_LINES, 0, nverts*nelements)
+            _drawElements(GL_LINES, nverts, elements)
 
+    @profiler.profiled("surface")
     def renderSurface(self, settings):
         vb = ngsolve.VOL if self.mesh.dim==2 else ngsolve.BND
         use_deformation = self.getDeformation()
 
-        for elements in self.mesh_data.elements[vb]:
-            if not (elements.type, elements.curved) in self.values[vb]['real']:
+        if settings.fastmode and not use_deformation:
+            element_blocks = self.mesh_data.getLODElements(vb, settings.frame_time)
+        else:
+            element_blocks = self.mesh_data.elements[vb]
+        for elements in _drawParts(element_blocks):
+            if not elements.key in self.values[vb]['real']:
                 return
             shader = ['mesh.vert', 'solution.frag']
             use_tessellation = use_deformation or elements.curved
             options = dict(DEFORMATION=use_deformation)
+            if elements.lod:
+                options['LOD'] = 1
             if use_tessellation:
-                shader.append('mesh.tese')
+                shader += ['mesh.tesc', 'mesh.tese']
 
             prog = getProgram(*shader, elements=elements, params=settings, scene=self, **options)
             prog.setFunction(self, elements, values=self.values[vb])
@@ -1031,35 +1291,31 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
 
             if use_deformation:
                 prog.setFunction(self, elements, cf=self.deformation, values=self._deformation_values[vb], index=1)
-                glActiveTexture(GL_TEXTURE4)
                 uniforms.set('deformation_scale', self.getDeformationScale())
 
 
             uniforms.set('wireframe', False)
 
-            tess_level = 10
-            if settings.fastmode and elements.nelements>10**4:
-                tess_level=1
-
-            glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
-            glPolygonOffset (1, 1)
-            glEnable(GL_POLYGON_OFFSET_FILL)
+            gl_state.polygonMode(GL_FILL)
+            gl_state.polygonOffset(1, 1)
+            gl_state.enable(GL_POLYGON_OFFSET_FILL)
+            ranges = self._getVisibleRanges(settings, elements)
             if use_tessellation:
+                _setTessellation(uniforms, settings, elements)
                 glPatchParameteri(GL_PATCH_VERTICES, elements.nverts)
-                glPatchParameterfv(GL_PATCH_DEFAULT_OUTER_LEVEL, [tess_level]*4)
-                glPatchParameterfv(GL_PATCH_DEFAULT_INNER_LEVEL, [tess_level]*2)
-                glDrawArrays(GL_PATCHES, 0, elements.nverts*elements.nelements)
+                _drawElements(GL_PATCHES, elements.nverts, elements, ranges, uniforms)
             else:
                 if elements.nverts==3:
-                    glDrawArrays(GL_TRIANGLES, 0, 3*elements.nelements)
+                    _drawElements(GL_TRIANGLES, 3, elements, ranges)
                 if elements.nverts==4:
-                    glDrawArraysInstanced(GL_TRIANGLES, 0, 3*elements.nelements, 2)
-            glDisable(GL_POLYGON_OFFSET_FILL)
+                    _drawElements(GL_TRIANGLES, 3, elements, ranges, uniforms, instances=2)
+            gl_state.disable(GL_POLYGON_OFFSET_FILL)
 
+    @profiler.profiled("iso_surface")
     def _renderIsoSurface(self, settings, elements):
-        self._filterElements(settings, elements, 1)
+        filter_feedback, filter_buffer = self._filterElements(settings, elements, 1)
         model, view, projection = settings.model, settings.view, settings.projection
-        prog = getProgram('pass_through.vert', 'isosurface.geom', 'solution.frag', elements=elements, params=settings, scene=self)
+        prog = getProgram('pass_through.vert', 'isosurface.geom', 'solution.frag', elements=elements, params=settings, scene=self, USE_INSTANCE_ID=True)
         prog.setFunction(self, elements)
         prog.setFunction(self, elements, cf=self.iso_surface, values=self.iso_values[ngsolve.VOL], index=2)
 
@@ -1069,13 +1325,19 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
         uniforms.set('iso_value', self.getIsoValue())
         uniforms.set('have_gradient', self.have_gradient)
 
-        glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+        gl_state.polygonMode(GL_FILL)
         instances = (self.getOrder()*(2**self.getSubdivision()))**3
-        prog.attributes.bind('element', self.filter_buffer)
-        for inst in range(instances):
-            uniforms.set('instance', inst)
-            glDrawTransformFeedback(GL_POINTS, self.filter_feedback)
+        prog.attributes.bind('element', filter_buffer)
+        if bool(glDrawTransformFeedbackInstanced):
+            uniforms.set('instance', 0)
+            filter_feedback.draw(GL_POINTS, instances)
+        else:
+            # OpenGL < 4.2
+            for inst in range(instances):
+                uniforms.set('instance', inst)
+                filter_feedback.draw(GL_POINTS)
 
+    @profiler.profiled("field_lines")
     def renderFieldLines(self, settings, elements):
         # use transform feedback to get position (and direction) of vectors on regular grid
 #         if not elements.curved:
@@ -1083,44 +1345,43 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
         if elements.type != ngsolve.ET.TET:
             return
 
-        glEnable(GL_RASTERIZER_DISCARD)
-        prog = getProgram('pass_through.vert', 'fieldlines_filter.geom', feedback=['pos','pos2', 'val', 'val2'], params=settings, scene=self,elements=elements, USE_GL_VERTEX_ID=True, FILTER_MODE='FIELDLINES')
-        prog.setFunction(self, elements)
-        prog.setFunction(self, elements, index=1, values=self.fieldline_values[ngsolve.VOL])
-        uniforms = prog.uniforms
-
-        uniforms.set('n_steps', self.getFieldLinesSteps())
-        uniforms.set('step_size', self.getFieldLinesStepsize())
+        def setup():
+            prog = getProgram('pass_through.vert', 'fieldlines_filter.geom', feedback=['pos','pos2', 'val', 'val2'], params=settings, scene=self,elements=elements, USE_GL_VERTEX_ID=True, FILTER_MODE='FIELDLINES')
+            prog.setFunction(self, elements)
+            prog.setFunction(self, elements, index=1, values=self.fieldline_values[ngsolve.VOL])
+            uniforms = prog.uniforms
 
-        filter_feedback = glGenTransformFeedbacks(1)
-        glBindTransformFeedback(GL_TRANSFORM_FEEDBACK, filter_feedback)
-        glBindBufferBase(GL_TRANSFORM_FEEDBACK_BUFFER, 0, self.filter_buffer.id)
-        glBeginTransformFeedback(GL_POINTS)
+            uniforms.set('n_steps', self.getFieldLinesSteps())
+            uniforms.set('step_size', self.getFieldLinesStepsize())
 
         el = self.getFieldLinesStartElement()
-        if el==-1:
-            glDrawArrays(GL_POINTS, 0, elements.nelements)
-        else:
-            glDrawArrays(GL_POINTS, el, 1)
+        def draw():
+            if el==-1:
+                glDrawArrays(GL_POINTS, 0, elements.nelements)
+            else:
+                glDrawArrays(GL_POINTS, el, 1)
 
-        glEndTransformFeedback()
-        glDisable(GL_RASTERIZER_DISCARD)
+        w=12 # vec3 = 12 bytes
+        stride = 4*w
+        key = (self.getFieldLinesSteps(), self.getFieldLinesStepsize(), el)
+        # start with one line segment per element, the buffer grows if more are generated
+        filter_feedback, filter_buffer = self._runFeedbackPass('fieldlines', elements, key, stride,
+                                                               elements.nelements if el==-1 else 20, setup, draw)
 
         # render actual vectors
         prog = getProgram('fieldlines.vert', 'fieldlines_draw.geom', 'fieldlines.frag', elements=elements, params=settings, scene=self)
         uniforms = prog.uniforms
         uniforms.set('grid_size', self.getFieldLinesThickness())
-        glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+        gl_state.polygonMode(GL_FILL)
 
-        w=12 # vec3 = 12 bytes
-        stride = 4*w
-        prog.attributes.bind('pos', self.filter_buffer, stride=stride, offset=0*w)
-        prog.attributes.bind('pos2', self.filter_buffer, stride=stride, offset=1*w)
-        prog.attributes.bind('val', self.filter_buffer, stride=stride, offset=2*w)
-        prog.attributes.bind('val2', self.filter_buffer, stride=stride, offset=3*w)
-        glDrawTransformFeedback(GL_POINTS, filter_feedback)
+        prog.attributes.bind('pos', filter_buffer, stride=stride, offset=0*w)
+        prog.attributes.bind('pos2', filter_buffer, stride=stride, offset=1*w)
+        prog.attributes.bind('val', filter_buffer, stride=stride, offset=2*w)
+        prog.attributes.bind('val2', filter_buffer, stride=stride, offset=3*w)
+        filter_feedback.draw(GL_POINTS)
 
 
+    @profiler.profiled("vectors")
     def renderVectors(self, settings, elements, mode):
         # use transform feedback to get position (and direction) of vectors on regular grid
         if mode == 'VOLUME_GRID':
@@ -1130,45 +1391,34 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
         else:
             raise RuntimeError("invalid mode: "+str(mode))
 
-        glEnable(GL_RASTERIZER_DISCARD)
-        prog = getProgram('pass_through.vert', 'vectors_filter.geom', feedback=['pos','val'], params=settings, scene=self, elements=elements, USE_GL_VERTEX_ID=True, FILTER_MODE=mode, CLIPPING=1)
-        prog.setFunction(self, elements)
+        def setup():
+            prog = getProgram('pass_through.vert', 'vectors_filter.geom', feedback=['pos','val'], params=settings, scene=self, elements=elements, USE_GL_VERTEX_ID=True, FILTER_MODE=mode, CLIPPING=1)
+            prog.setFunction(self, elements)
 
-        uniforms = prog.uniforms
-
-        uniforms.set('grid_size', grid_size)
+            uniforms = prog.uniforms
 
-        filter_feedback = glGenTransformFeedbacks(1)
-        glBindTransformFeedback(GL_TRANSFORM_FEEDBACK, filter_feedback)
-        glBindBufferBase(GL_TRANSFORM_FEEDBACK_BUFFER, 0, self.filter_buffer.id)
-        glBeginTransformFeedback(GL_POINTS)
+            uniforms.set('grid_size', grid_size)
 
-
-        filter_first = 0
-        for i in range(20): # maxmimal 20*40=800 vectors per element
-            uniforms.set('filter_first', filter_first)
-            with Query(GL_TRANSFORM_FEEDBACK_PRIMITIVES_WRITTEN) as q:
-                glDrawArrays(GL_POINTS, 0, elements.nelements)
-            filter_first+=40
-            if q.value==0:
-                break;
-
-        glEndTransformFeedback()
-        glDisable(GL_RASTERIZER_DISCARD)
+        key = (grid_size, self._clippingKey())
+        # pos and val (2*vec3 = 24 bytes) per vector, start with one vector per element
+        # maximal 20*40=800 vectors per element, computed by 20 invocations of the geometry shader
+        filter_feedback, filter_buffer = self._runFeedbackPass('vectors_'+mode, elements, key, 24, elements.nelements, setup,
+                                                               lambda: glDrawArrays(GL_POINTS, 0, elements.nelements))
 
         # render actual vectors
         prog = getProgram('vectors.vert', 'vectors_draw.geom', 'vectors.frag', elements=elements, params=settings, scene=self)
         uniforms = prog.uniforms
         uniforms.set('grid_size', grid_size)
-        glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+        gl_state.polygonMode(GL_FILL)
 
-        prog.attributes.bind('pos', self.filter_buffer, stride=24, offset=0)
-        prog.attributes.bind('val', self.filter_buffer, stride=24, offset=12)
-        glDrawTransformFeedback(GL_POINTS, filter_feedback)
+        prog.attributes.bind('pos', filter_buffer, stride=24, offset=0)
+        prog.attributes.bind('val', filter_buffer, stride=24, offset=12)
+        filter_feedback.draw(GL_POINTS)
 
 
+    @profiler.profiled("clipping_plane")
     def _renderClippingPlane(self, settings, elements):
-        self._filterElements(settings, elements, 0)
+        filter_feedback, filter_buffer = self._filterElements(settings, elements, 0)
         prog = getProgram('pass_through.vert', 'clipping.geom', 'solution.frag', elements=elements, params=settings, scene=self, CLIPPING=1, SKIP_FRAGMENT_CLIPPING=1)
         prog.setFunction(self, elements)
 
@@ -1178,11 +1428,11 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
 
         for i in range(elements.n_instances_3d):
             uniforms.set('subtet', i)
-            glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
-            glPolygonOffset (1, 1)
-            glEnable(GL_POLYGON_OFFSET_FILL)
-            prog.attributes.bind('element', self.filter_buffer)
-            glDrawTransformFeedback(GL_POINTS, self.filter_feedback)
+            gl_state.polygonMode(GL_FILL)
+            gl_state.polygonOffset(1, 1)
+            gl_state.enable(GL_POLYGON_OFFSET_FILL)
+            prog.attributes.bind('element', filter_buffer)
+            filter_feedback.draw(GL_POINTS)
 
 
     def render(self, settings):
@@ -1191,7 +1441,7 @@ class SolutionScene(BaseMeshScene, settings.ColormapSettings):
 
         with self._vao:
             if self.mesh.dim==1:
-                for els in self.mesh_data.elements[ngsolve.VOL]:
+                for els in _drawParts(self.mesh_data.elements[ngsolve.VOL]):
                     self._render1D(settings, els)
 
             if self.mesh.dim > 1:
@@ -1228,19 +1478,13 @@ class FacetSolutionScene(BaseMeshScene, settings.ColormapSettings):
                 kwargs['deformation'] = ngsolve.CoefficientFunction((0,0,cf))
         super().__init__(mesh, *args,**kwargs)
 
-    def update(self):
+    def _prepareUpdate(self, sd, order):
         # we have to update the deformation differently
-        deform = self.deformation
-        if deform:
-            self.deformation = None
-        super().update()
-        if deform:
-            self._deformation_values = {}
-            self.deformation = deform
-            self._getValues(self.deformation, "facet", self.getSubdivision(),
-                            self.getOrder(), self._deformation_values)
-        self._getValues(self.cf, "facet", self.getSubdivision(), self.getOrder(),
-                        self.values)
+        uploads = [prepareOpenGLData(self.mesh)]
+        if self.deformation:
+            uploads.append(self._prepareValues(self.deformation, "facet", sd, order, self._deformation_values))
+        uploads.append(self._prepareValues(self.cf, "facet", sd, order, self.values))
+        return uploads
 
     def _createParameters(self):
         super()._createParameters()
@@ -1278,28 +1522,25 @@ class FacetSolutionScene(BaseMeshScene, settings.ColormapSettings):
                 prog = getProgram(*shader, elements=facets, params=settings, scene=self, **options)
                 uniforms = prog.uniforms
                 if use_deformation:
-                    glActiveTexture(GL_TEXTURE4)
-                    self._deformation_values["facet"]['real'][(facets.type, facets.curved)].bind()
+                    self._deformation_values["facet"]['real'][(facets.type, facets.curved)].bind(4)
                     uniforms.set('deformation_coefficients', 4)
                     uniforms.set('deformation_subdivision', 2**self.getSubdivision()-1)
                     uniforms.set('deformation_order', self.getOrder())
                     uniforms.set('deformation_scale', self.getDeformationScale())
-                glActiveTexture(GL_TEXTURE2)
-                self.values["facet"]['real'][(facets.type, facets.curved)].bind()
+                self.values["facet"]['real'][(facets.type, facets.curved)].bind(2)
                 uniforms.set('coefficients', 2)
                 uniforms.set('subdivision', 2**self.getSubdivision()-1)
                 uniforms.set('component',comp)
                 uniforms.set('is_complex', self.cf.is_complex)
                 if self.cf.is_complex:
-                    glActiveTexture(GL_TEXTURE3)
-                    self.values["facet"]['imag'][facets.type, facets.curved].bind()
+                    self.values["facet"]['imag'][facets.type, facets.curved].bind(3)
                     uniforms.set('coefficients_imag', 3)
 
                     uniforms.set('complex_vis_function', SolutionScene._complex_eval_funcs[self.getComplexEvalFunc()])
                     w = cmath.exp(1j*self.getComplexPhaseShift()/180.0*math.pi)
                     uniforms.set('complex_factor', [w.real, w.imag])
 
-                glPolygonMode( GL_FRONT_AND_BACK, GL_FILL );
+                gl_state.polygonMode(GL_FILL)
                 if self.mesh.dim == 2:
                     glDrawArrays(GL_LINES, 0, 2*len(facets.data)//facets.size)
                 else:
@@ -1382,23 +1623,19 @@ class GeometryScene(BaseScene):
             prog = getProgram('geo.vert', 'geo.frag', params=settings, scene=self)
             uniforms = prog.uniforms
 
-            glActiveTexture(GL_TEXTURE0)
-            self._geo_data.vertices.bind()
+            self._geo_data.vertices.bind(0)
             uniforms.set('vertices', 0)
 
-            glActiveTexture(GL_TEXTURE1)
-            self._geo_data.triangles.bind()
+            self._geo_data.triangles.bind(1)
             uniforms.set('triangles',1)
 
-            glActiveTexture(GL_TEXTURE2)
-            self._geo_data.normals.bind()
+            self._geo_data.normals.bind(2)
             uniforms.set('normals',2)
 
-            glActiveTexture(GL_TEXTURE3)
-            self._tex_colors.bind()
+            self._tex_colors.bind(3)
             uniforms.set('colors',3)
 
-            glPolygonMode(GL_FRONT_AND_BACK, GL_FILL )
+            gl_state.polygonMode(GL_FILL)
             glDrawArrays(GL_TRIANGLES, 0, self._geo_data.npoints)
 
 class GeometryScene2D(BaseScene):
@@ -1482,8 +1719,7 @@ class GeometryScene2D(BaseScene):
         prog = getProgram('geom2d.vert', 'geo.frag', params=settings, scene=self, NOLIGHT=True)
         uniforms = prog.uniforms
 
-        glActiveTexture(GL_TEXTURE0)
-        self._tex_bc_colors.bind()
+        self._tex_bc_colors.bind(0)
         uniforms.set('colors', 0)
 
         prog.attributes.bind('pos', self.vertices)
@@ -1507,6 +1743,10 @@ def _LoadMesh(gui, filename):
     else:
         from netgen.meshing import ImportMesh
         mesh = ngsolve.Mesh(ImportMesh(filename))
+    if MeshData.disk_cache.enabled:
+        # tag the mesh with its file content, the visualization data can then be taken from the disk cache
+        from .cache import hashFile
+        mesh._ngsgui_file_hash = (hashFile(filename), mesh.ngmesh._timestamp)
     ngsolve.Draw(mesh)
     if not gui._flags.noConsole:
         gui.console.pushVariables({"mesh" : mesh })
@@ -601,6 +601,16 @@ class CameraSettings(BaseSettings):
         self.dy = 0.0
 
         self.fastmode = False
+        # tessellation level of large curved element blocks, lowered in the first frames after
+        # interaction ends (see GLWidget._startRefinement)
+        self.tess_level = 10
+        # allowed deviation of tessellated curved elements from the exact geometry in pixels (see
+        # mesh.tesc), adapted to the frame time budget by GLWidget._adaptTessellation
+        self.tess_tolerance = 1.0
+        # width and height of the GL window in pixels
+        self.viewport_size = (800, 800)
+        # time needed to render the last frame (in seconds)
+        self.frame_time = 0.0
 
         self.min = glmath.Vector(3)
         self.min[:] = 0.0
@@ -13,6 +13,8 @@ uniform bool filter_elements;
 uniform samplerBuffer tex_filter;
 uniform float filter_min;
 uniform float filter_max;
+// number of the first instance, if the instances are drawn with separate draw calls (see scenes._drawElements)
+uniform int instance_offset;
 
 out VertexData
 {
@@ -35,6 +37,8 @@ void main()
 #endif
   int eid = gl_VertexID/nverts;
   int vid = gl_VertexID - nverts*eid;
+  // also set for filtered elements, the tessellation shaders read their element from it
+  outData.element = eid;
 
   if(filter_elements)
   {
@@ -48,7 +52,10 @@ void main()
   }
 
   ELEMENT_TYPE element = getElement(eid);
-  outData.element = eid;
+#ifdef LOD
+  // decimated surfaces store the number of the element in the original element block
+  outData.element = getElementNr(eid);
+#endif
   outData.normal = vec3(0,0,0);
   outData.lam = vec3(0,0,0);
   outData.pos = element.pos[vid];
@@ -91,7 +98,7 @@ void main()
     outData.normal = texelFetch(mesh.vertices, element.curved_vertices+vid).xyz;
   #else
     outData.normal = element.normal;
-    int fid = gl_InstanceID;
+    int fid = gl_InstanceID + instance_offset;
     if(fid==1)
     {
       vid = ivec3(0,3,2)[vid];
@@ -104,14 +111,14 @@ void main()
 #elif defined(ET_TET)
     // draw faces of 3d elements using multiple instances (gl_InstanceID)
     // the 4 faces are using vertices [1,2,3],[0,2,3],[0,1,3],[0,1,2]
-    int fid = gl_InstanceID;
+    int fid = gl_InstanceID + instance_offset;
     ivec3 verts = ivec3(0,1,2);
     for (int i=fid; i<3; i++)
         verts[i]++;
 #elif defined(ET_HEX)
     // draw faces of 3d elements using multiple instances (gl_InstanceID)
     // 6 quads -> 12 triangles in total
-    int fid = gl_InstanceID;
+    int fid = gl_InstanceID + instance_offset;
     ivec3 verts;
     if (fid<4) {
         verts = ivec3(fid,(fid+1)%4,fid+4);
@@ -131,7 +138,7 @@ void main()
 #elif defined(ET_PRISM)
     // draw faces of 3d elements using multiple instances (gl_InstanceID)
     // 3 quads + 2 trigs -> 8 triangles in total
-    int fid = gl_InstanceID;
+    int fid = gl_InstanceID + instance_offset;
     ivec3 verts;
     if (fid==0) verts = ivec3(0,1,2);
     else if (fid==1) verts = ivec3(0,1,3);
@@ -145,7 +152,7 @@ void main()
 #elif defined(ET_PYRAMID)
     // draw faces of 3d elements using multiple instances (gl_InstanceID)
     // 1 quads + 4 trigs -> 6 triangles in total
-    int fid = gl_InstanceID;
+    int fid = gl_InstanceID + instance_offset;
     ivec3 verts;
     if (fid==0) verts = ivec3(0,1,2);
     else if (fid==1) verts = ivec3(2,3,0);
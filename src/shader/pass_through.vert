@@ -7,10 +7,16 @@ in int element;
 out VertexData
 {
   flat int element;
+#ifdef USE_INSTANCE_ID
+  flat int instance;
+#endif
 } outData;
 
 void main()
 {
+#ifdef USE_INSTANCE_ID
+  outData.instance = gl_InstanceID;
+#endif
 #ifdef USE_GL_VERTEX_ID
   outData.element = gl_VertexID;
 #else
@@ -147,3 +147,80 @@ def inmain_decorator(wait_for_return=True, exceptions_in_main=True):
             return _in_main_later(fn, exceptions_in_main, *args, **kwargs)
         return f
     return wrap
+
+
+# Background tasks: expensive CPU work (e.g. evaluation of visualization data) is done in a worker
+# thread pool, only the final step (e.g. the upload to the GPU) is done in the main thread.
+# Background tasks are disabled by default (e.g. for headless rendering), then everything runs
+# synchronously in the calling thread. The GUI enables them on startup.
+
+_executor = None
+
+def enableBackgroundTasks(max_workers=None):
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ngsgui_worker")
+
+def disableBackgroundTasks():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+def backgroundTasksEnabled():
+    return _executor is not None
+
+class BackgroundTask:
+    """Computes result = compute(*args, **kwargs) in a worker thread and calls finish(result) in the
+main thread afterwards. If the task is started again before a previous run is finished, the result
+of the previous run is discarded, so finish is only called with up to date results.
+Exceptions in compute are raised in the main thread (or in wait).
+
+Parameters
+----------
+compute : function
+  Does the expensive work, must not use OpenGL or Qt widgets.
+finish : function
+  Called with the result of compute in the main thread.
+"""
+    def __init__(self, compute, finish):
+        self._compute = compute
+        self._finish = finish
+        self._generation = 0
+        self._finished_generation = 0
+        self._future = None
+
+    def start(self, *args, blocking=False, **kwargs):
+        self._generation += 1
+        generation = self._generation
+        if blocking or _executor is None:
+            self._future = None
+            self._finishGeneration(generation, self._compute(*args, **kwargs))
+            return
+        def run():
+            try:
+                result = (self._compute(*args, **kwargs), None)
+            except Exception:
+                import sys
+                result = (None, sys.exc_info())
+            _in_main_later(self._finishGeneration, True, generation, *result)
+            return result
+        self._future = _executor.submit(run)
+
+    def _finishGeneration(self, generation, result, exception=None):
+        # discard stale results and results that were already applied by wait
+        if generation != self._generation or self._finished_generation == generation:
+            return
+        self._finished_generation = generation
+        if exception is not None:
+            _reraise(exception)
+        self._finish(result)
+
+    def running(self):
+        return self._finished_generation != self._generation
+
+    def wait(self):
+        """Blocks until the last started run is finished and applies its result, must be called from the main thread"""
+        if self._future is not None and self.running():
+            self._finishGeneration(self._generation, *self._future.result())
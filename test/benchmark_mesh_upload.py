@@ -0,0 +1,44 @@
+"""
+Benchmark for the upload of mesh data (MeshData.update) to the GPU.
+
+Reports the time needed for the upload and the peak memory usage for meshes of
+increasing size. Run it directly:
+    python3 benchmark_mesh_upload.py [maxh ...]
+"""
+
+import sys, time, resource, tracemalloc
+from headless import *
+import ngsolve as ngs
+from netgen.csg import unit_cube
+from ngsgui.gl_interface import MeshData
+
+ngs.ngsglobals.msg_level = 0
+
+def peakRSS():
+    # ru_maxrss is given in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def benchmark(mesh, repetitions=3):
+    times = []
+    peak = 0
+    for i in range(repetitions):
+        if hasattr(mesh, '_opengl_data'):
+            del mesh._opengl_data
+        tracemalloc.start()
+        t = time.time()
+        MeshData(mesh)
+        GL.glFinish()
+        times.append(time.time()-t)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(times), peak/1024**2
+
+if __name__ == '__main__':
+    gui = HeadlessGUI()
+    sizes = [float(h) for h in sys.argv[1:]] or [0.2, 0.1, 0.05, 0.03]
+    print("{:>8} {:>10} {:>10} {:>12} {:>14}".format("maxh", "nv", "ne", "time [s]", "peak [MB]"))
+    for maxh in sizes:
+        mesh = ngs.Mesh(unit_cube.GenerateMesh(maxh=maxh))
+        t, peak = benchmark(mesh)
+        print("{:>8} {:>10} {:>10} {:>12.4f} {:>14.1f}".format(maxh, mesh.nv, mesh.ne, t, peak))
+    print("peak RSS of process: {:.1f} MB".format(peakRSS()))
@@ -0,0 +1,52 @@
+"""
+Micro benchmark for the reference point sets and integration rules of the function evaluation
+(gl_interface.getReferenceRules).
+
+Reports the time to build the rules (first call), to look them up again (memoized) and, for
+comparison, to build them from python list comprehensions for orders 1-6 and subdivisions 0-4.
+Run it directly:
+    python3 benchmark_rules.py [repetitions]
+"""
+
+import sys, time
+import ngsolve as ngs
+from ngsgui.gl_interface import getReferenceRules, getReferencePoints
+
+def comprehensionRules(order, sd):
+    n = order*(sd+1)+1
+    h = 1.0/(n-1)
+    res = {}
+    res[ngs.ET.SEGM] = [ (1.0-i*h,0.0,0.0) for i in range(n) ]
+    res[ngs.ET.TRIG] = [ (i*h,j*h,0.0) for j in range(n) for i in range(n-j) ]
+    res[ngs.ET.QUAD] = [ (i*h,j*h,0.0) for j in range(n) for i in range(n) ]
+    res[ngs.ET.TET]  = [ (i*h,j*h,k*h) for k in range(n) for j in range(n-k) for i in range(n-k-j) ]
+    res[ngs.ET.HEX]  = [ (i*h,j*h,k*h) for k in range(n) for j in range(n) for i in range(n) ]
+    res[ngs.ET.PRISM]= [ (i*h,j*h,k*h) for k in range(n) for j in range(n) for i in range(n-j) ]
+    res[ngs.ET.PYRAMID] = [ (0,0,0), (1,0,0), (0,1,0), (1,1,0), (0,0,1) ]
+    return { et : ngs.IntegrationRule(points, [0.0]*len(points)) for et, points in res.items() }
+
+def clearCaches():
+    getReferencePoints._cache.clear()
+    getReferenceRules._cache.clear()
+
+def benchmark(func, repetitions, setup=None):
+    t = 0
+    for i in range(repetitions):
+        if setup:
+            setup()
+        start = time.time()
+        func()
+        t += time.time()-start
+    return 1e3*t/repetitions
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv)>1 else 3
+    print("{:>5} {:>5} {:>10} {:>14} {:>14} {:>14}".format("order", "sd", "points", "build [ms]", "lookup [ms]", "lists [ms]"))
+    for order in range(1,7):
+        for subdivision in range(5):
+            sd = 2**subdivision-1
+            npoints = sum(len(p) for p in getReferencePoints(order, sd).values())
+            build = benchmark(lambda: getReferenceRules(order, sd), repetitions, setup=clearCaches)
+            lookup = benchmark(lambda: getReferenceRules(order, sd), 100*repetitions)
+            lists = benchmark(lambda: comprehensionRules(order, sd), repetitions)
+            print("{:>5} {:>5} {:>10} {:>14.3f} {:>14.5f} {:>14.3f}".format(order, subdivision, npoints, build, lookup, lists))
@@ -0,0 +1,54 @@
+"""
+Micro benchmark for setting uniforms (Program.Uniforms.set).
+
+Reports the number of uniform updates per second for different uniform types. Run it directly:
+    python3 benchmark_uniforms.py [repetitions]
+"""
+
+import sys, time
+from headless import *
+import numpy as np
+import ngsolve as ngs
+from ngsgui.gl import Shader, Program
+from ngsgui import glmath
+
+vertex_code = """
+#version 150
+uniform mat4 P;
+uniform vec3 offset;
+uniform float scale;
+uniform int n;
+in vec3 pos;
+void main() { gl_Position = P*vec4(scale*pos+offset*n, 1); }
+"""
+
+fragment_code = """
+#version 150
+out vec4 color;
+void main() { color = vec4(1,0,0,1); }
+"""
+
+def benchmark(uniforms, name, value, repetitions):
+    t = time.time()
+    for i in range(repetitions):
+        uniforms.set(name, value)
+    GL.glFinish()
+    return repetitions/(time.time()-t)
+
+if __name__ == '__main__':
+    gui = HeadlessGUI()
+    repetitions = int(sys.argv[1]) if len(sys.argv)>1 else 100000
+    prog = Program([Shader(vertex_code, shader_type=GL.GL_VERTEX_SHADER),
+                    Shader(fragment_code, shader_type=GL.GL_FRAGMENT_SHADER)])
+    GL.glUseProgram(prog.id)
+    uniforms = prog.uniforms
+    cases = [ ("int", 'n', 3),
+              ("float", 'scale', 0.5),
+              ("vec3 (list)", 'offset', [1.0, 2.0, 3.0]),
+              ("vec3 (numpy)", 'offset', np.array([1.0, 2.0, 3.0], dtype=np.float32)),
+              ("mat4 (ngsolve)", 'P', glmath.Perspective(0.8, 1.0, 0.1, 10)),
+              ("mat4 (numpy)", 'P', np.eye(4, dtype=np.float32)),
+              ("unknown name", 'not_there', 1) ]
+    print("{:>16} {:>16}".format("type", "updates/s"))
+    for label, name, value in cases:
+        print("{:>16} {:>16.0f}".format(label, benchmark(uniforms, name, value, repetitions)))
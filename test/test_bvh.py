@@ -0,0 +1,80 @@
+import numpy as np
+from ngsgui.bvh import ElementBVH, intersectTriangles, maskRanges, intersectRanges, mergeRanges
+
+def _grid(n):
+    """n*n*2 triangles on the unit square"""
+    x, y = np.meshgrid(np.linspace(0,1,n+1), np.linspace(0,1,n+1))
+    points = np.stack([x.ravel(), y.ravel(), np.zeros((n+1)**2)], axis=1).astype(np.float32)
+    idx = np.arange((n+1)**2).reshape(n+1,n+1)
+    a, b, c, d = idx[:-1,:-1].ravel(), idx[1:,:-1].ravel(), idx[:-1,1:].ravel(), idx[1:,1:].ravel()
+    trigs = np.concatenate([np.stack([a,b,c],1), np.stack([b,d,c],1)])
+    rows = np.zeros((len(trigs),5), dtype=np.int32)
+    rows[:,0] = np.arange(len(trigs))
+    rows[:,2:] = trigs
+    return points, rows
+
+def _elements(ranges):
+    return np.concatenate([np.arange(f, f+c) for f,c in zip(*ranges)] + [np.zeros(0, dtype=int)])
+
+def test_all_visible():
+    points, rows = _grid(100)
+    bvh = ElementBVH(points, rows, 3)
+    first, count = bvh.visibleRanges([[0,0,1,1]])
+    assert list(first) == [0] and list(count) == [len(rows)]
+
+def test_culling():
+    points, rows = _grid(100)
+    bvh = ElementBVH(points, rows, 3)
+    # half space x <= 0.25
+    ranges = bvh.visibleRanges([[-1,0,0,0.25]])
+    visible = _elements(ranges)
+    assert 0 < len(visible) < len(rows)
+    # no element intersecting the half space may be culled
+    p = points[rows[:,2:5]]
+    needed = np.flatnonzero(p[:,:,0].min(axis=1) <= 0.25)
+    assert np.isin(needed, visible).all()
+    # nothing is visible outside of the domain
+    assert len(_elements(bvh.visibleRanges([[1,0,0,-2]]))) == 0
+
+def test_ray():
+    points, rows = _grid(100)
+    bvh = ElementBVH(points, rows, 3)
+    origin = np.array([0.123, 0.456, 1.0])
+    direction = np.array([0.0, 0.0, -1.0])
+    candidates = _elements(bvh.rayRanges(origin, direction))
+    assert 0 < len(candidates) < len(rows)
+    p = points[rows[candidates,2:5]].astype(np.float64)
+    t, u, v = intersectTriangles(p[:,0], p[:,1], p[:,2], origin, direction)
+    k = np.argmin(t)
+    assert np.isclose(t[k], 1.0)
+    hit = p[k,0] + u[k]*(p[k,1]-p[k,0]) + v[k]*(p[k,2]-p[k,0])
+    assert np.allclose(hit, [0.123, 0.456, 0])
+    # ray pointing away from the surface
+    candidates = _elements(bvh.rayRanges(origin, -direction))
+    assert len(candidates) == 0
+
+def test_ranges():
+    mask = np.zeros(1000, dtype=bool)
+    mask[10:20] = mask[500:501] = mask[990:] = True
+    first, count = maskRanges(mask)
+    assert list(first) == [10, 500, 990] and list(count) == [10, 1, 10]
+    assert np.array_equal(_elements((first, count)), np.flatnonzero(mask))
+    other = np.zeros(1000, dtype=bool)
+    other[15:600] = other[995:998] = True
+    ranges = intersectRanges((first, count), maskRanges(other))
+    assert np.array_equal(_elements(ranges), np.flatnonzero(mask & other))
+    assert len(_elements(intersectRanges((first, count), maskRanges(~mask)))) == 0
+
+def test_merge_ranges():
+    ranges = (np.array([0, 10, 13, 50, 100]), np.array([5, 2, 1, 10, 1]))
+    first, count = mergeRanges(ranges)
+    assert list(first) == [0, 10, 13, 50, 100] and list(count) == [5, 2, 1, 10, 1]
+    first, count = mergeRanges(ranges, max_gap=5)
+    assert list(first) == [0, 50, 100] and list(count) == [14, 10, 1]
+    # the smallest gaps are merged first, merged ranges cover all entries
+    first, count = mergeRanges(ranges, max_ranges=2)
+    assert list(first) == [0, 100] and list(count) == [60, 1]
+    first, count = mergeRanges(ranges, max_ranges=1)
+    assert list(first) == [0] and list(count) == [101]
+    empty = np.zeros(0, dtype=np.int32)
+    assert len(mergeRanges((empty, empty), max_ranges=1)[0]) == 0
@@ -0,0 +1,93 @@
+import os
+from ngsgui.cache import FileCache, MemoryCache
+
+def _writeFile(size):
+    def write(directory):
+        with open(os.path.join(directory, "data"), "wb") as f:
+            f.write(b"x"*size)
+    return write
+
+def test_store_lookup(tmpdir):
+    cache = FileCache("test", max_size=1000, location=str(tmpdir))
+    assert cache.lookup("a") is None
+    path = cache.store("a", _writeFile(10))
+    assert cache.lookup("a") == path
+    assert open(os.path.join(path, "data"), "rb").read() == b"x"*10
+    cache.remove("a")
+    assert cache.lookup("a") is None
+
+def test_lru_eviction(tmpdir):
+    cache = FileCache("test", max_size=250, location=str(tmpdir))
+    cache.store("a", _writeFile(100))
+    cache.store("b", _writeFile(100))
+    # make "a" the most recently used entry
+    os.utime(cache.lookup("b"), (0,0))
+    cache.lookup("a")
+    cache.store("c", _writeFile(100))
+    assert cache.lookup("a") is not None
+    assert cache.lookup("b") is None
+    assert cache.lookup("c") is not None
+    assert cache.size() <= 250
+
+def test_disabled(tmpdir):
+    cache = FileCache("test", max_size=1000, location=str(tmpdir))
+    cache.enabled = False
+    assert cache.store("a", _writeFile(10)) is None
+    assert cache.lookup("a") is None
+
+def test_memory_cache():
+    cache = MemoryCache(max_size=250)
+    assert cache.lookup("a") is None
+    cache.store("a", "value a", 100)
+    cache.store("b", "value b", 100)
+    assert cache.lookup("a") == "value a"
+    # "b" is the least recently used entry now
+    cache.store("c", "value c", 100)
+    assert cache.lookup("b") is None
+    assert cache.lookup("c") == "value c"
+    # too large for the cache
+    cache.store("d", "value d", 300)
+    assert cache.lookup("d") is None
+    assert cache.getStats() == { 'hits' : 2, 'misses' : 3, 'evictions' : 1,
+                                 'entries' : 2, 'size' : 200, 'max_size' : 250 }
+
+def test_values_cache_weak():
+    import gc, weakref
+    import ngsolve as ngs
+    from netgen.geom2d import unit_square
+    from ngsgui.gl_interface import getValuesKey, storeValues, lookupValues, values_cache
+    mesh = ngs.Mesh(unit_square.GenerateMesh(maxh=0.5))
+    gf = ngs.GridFunction(ngs.H1(mesh))
+    key = getValuesKey(gf, mesh, ngs.VOL, 1, 0)
+    values = { 'real' : {}, 'imag' : {}, 'min' : [0], 'max' : [0] }
+    storeValues(key, gf, mesh, values)
+    assert lookupValues(key, gf, mesh) is values
+    # another object with the same key (e.g. reusing the id) does not get the values
+    assert lookupValues(key, ngs.GridFunction(gf.space), mesh) is None
+    # the cache entry must not keep the GridFunction alive
+    storeValues(key, gf, mesh, values)
+    ref = weakref.ref(gf)
+    del gf
+    gc.collect()
+    assert ref() is None
+    assert values_cache.lookup(key) is None
+
+def test_values_cache_invalidate():
+    import ngsolve as ngs
+    from netgen.geom2d import unit_square
+    from ngsgui.gl_interface import getValuesKey, storeValues, lookupValues, invalidateValues
+    mesh = ngs.Mesh(unit_square.GenerateMesh(maxh=0.5))
+    gf = ngs.GridFunction(ngs.H1(mesh))
+    cf = ngs.x*gf
+    values = { 'real' : {}, 'imag' : {}, 'min' : [0], 'max' : [0] }
+    for f in (gf, cf):
+        storeValues(getValuesKey(f, mesh, ngs.VOL, 1, 0), f, mesh, values)
+    # Redraw: the values of an unchanged GridFunction are kept, other functions are evaluated again
+    invalidateValues()
+    assert lookupValues(getValuesKey(gf, mesh, ngs.VOL, 1, 0), gf, mesh) is values
+    assert lookupValues(getValuesKey(cf, mesh, ngs.VOL, 1, 0), cf, mesh) is None
+    # the vector changed (without Redraw the old values are still drawn)
+    gf.Set(ngs.x)
+    assert lookupValues(getValuesKey(gf, mesh, ngs.VOL, 1, 0), gf, mesh) is values
+    invalidateValues()
+    assert lookupValues(getValuesKey(gf, mesh, ngs.VOL, 1, 0), gf, mesh) is None
@@ -0,0 +1,53 @@
+import types
+import numpy as np
+import ngsolve
+from ngsgui.lod import SurfaceLOD, prepareSurfaceLevels, clusterPoints, _clusterVertices
+
+def _grid(n):
+    """n*n*2 triangles on the unit square, rows are [nr, index, v0, v1, v2]"""
+    x, y = np.meshgrid(np.linspace(0,1,n+1), np.linspace(0,1,n+1))
+    points = np.stack([x.ravel(), y.ravel(), np.zeros((n+1)**2)], axis=1)
+    idx = np.arange((n+1)**2).reshape(n+1,n+1)
+    a, b, c, d = idx[:-1,:-1].ravel(), idx[1:,:-1].ravel(), idx[:-1,1:].ravel(), idx[1:,1:].ravel()
+    trigs = np.concatenate([np.stack([a,b,c],1), np.stack([b,d,c],1)])
+    rows = np.zeros((len(trigs),5), dtype=np.int32)
+    rows[:,0] = np.arange(len(trigs))
+    rows[:,1] = (trigs[:,0] % 2)
+    rows[:,2:] = trigs
+    return points, rows
+
+def test_cluster_vertices():
+    points, rows = _grid(20)
+    trigs = rows[:,2:]
+    new_points, new_trigs, source, clusters = _clusterVertices(points, trigs, 0.2)
+    assert 0 < len(new_trigs) < len(trigs)
+    # no degenerated or duplicated triangles
+    assert (new_trigs[:,0] != new_trigs[:,1]).all() and (new_trigs[:,1] != new_trigs[:,2]).all() and (new_trigs[:,0] != new_trigs[:,2]).all()
+    assert len(np.unique(np.sort(new_trigs, axis=1), axis=0)) == len(new_trigs)
+    assert (source >= 0).all() and (source < len(trigs)).all()
+    assert new_trigs.max() < len(new_points)
+    # cluster means stay in the domain, moving all vertices moves the clusters
+    assert (new_points >= 0).all() and (new_points <= 1).all()
+    assert np.allclose(clusterPoints(points, clusters), new_points)
+    assert np.allclose(clusterPoints(points+[1,2,3], clusters), new_points+[1,2,3])
+
+def test_surface_levels(monkeypatch):
+    monkeypatch.setattr(SurfaceLOD, "min_triangles", 100)
+    monkeypatch.setattr(SurfaceLOD, "budget", 400)
+    points, rows = _grid(30)
+    block = types.SimpleNamespace(type=ngsolve.ET.TRIG, offset=0, nelements=len(rows), size=5)
+    levels = prepareSurfaceLevels(points.astype(np.float32).ravel(), rows.ravel(), [block])
+    assert len(levels) > 0
+    ntrigs = [len(eldata)//5 for points, eldata, parts, clusters in levels]
+    assert ntrigs[0] <= 400 and ntrigs == sorted(ntrigs, reverse=True)
+    for new_points, eldata, parts, clusters in levels:
+        r = eldata.reshape(-1,5)
+        assert parts == [(block, 0, len(r))]
+        # every decimated triangle refers to an original triangle with the same index
+        assert (r[:,0] < len(rows)).all()
+        assert np.array_equal(r[:,1], rows[r[:,0],1])
+        assert r[:,2:].max() < len(new_points)//3
+
+    # too small meshes are not decimated
+    monkeypatch.setattr(SurfaceLOD, "min_triangles", 10**6)
+    assert prepareSurfaceLevels(points.ravel(), rows.ravel(), [block]) == []
@@ -0,0 +1,41 @@
+import numpy as np
+import ngsolve as ngs
+from netgen.csg import unit_cube
+from netgen.geom2d import unit_square
+from ngsgui.gl_interface import MeshData
+from ngsgui.bvh import ElementBVH
+
+def _moveAndPrepare(mesh):
+    previous = MeshData.prepare(mesh)
+    mesh.ngmesh.Scale(2.0)
+    return previous, MeshData.prepare(mesh, previous), MeshData.prepare(mesh)
+
+def test_moved_vertices(monkeypatch):
+    monkeypatch.setattr(ElementBVH, "min_elements", 10)
+    for geo in (unit_cube, unit_square):
+        mesh = ngs.Mesh(geo.GenerateMesh(maxh=0.2))
+        previous, moved, full = _moveAndPrepare(mesh)
+        assert np.allclose(moved["vertices"], full["vertices"])
+        assert list(moved["min"]) == list(full["min"]) and list(moved["max"]) == list(full["max"])
+        for vb, (eldata, infos, offsets, bvhs, straight) in full["elements"].items():
+            # element data is reused, the boxes of the hierarchies are computed for the moved vertices
+            assert moved["elements"][vb][0] is previous["elements"][vb][0]
+            assert np.array_equal(moved["elements"][vb][0], eldata)
+            for bvh, moved_bvh in zip(bvhs, moved["elements"][vb][3]):
+                assert (bvh is None) == (moved_bvh is None)
+                if bvh is not None:
+                    assert np.array_equal(bvh.levels[-1][1], moved_bvh.levels[-1][1])
+
+def test_curved_and_refined():
+    # curved geometry is computed by ngsolve
+    mesh = ngs.Mesh(unit_square.GenerateMesh(maxh=0.2))
+    mesh.Curve(3)
+    previous, moved, full = _moveAndPrepare(mesh)
+    assert np.allclose(moved["vertices"], full["vertices"])
+    # changed topology
+    mesh = ngs.Mesh(unit_square.GenerateMesh(maxh=0.2))
+    previous, moved, full = _moveAndPrepare(mesh)
+    mesh.Refine()
+    refined = MeshData.prepare(mesh, moved)
+    assert refined["topology"] != moved["topology"]
+    assert len(refined["vertices"]) > len(moved["vertices"])
@@ -89,6 +89,88 @@ def test_mesh(name, mesh):
     s.setShowWireframe(False)
     gui.checkImage(s, name+'_surface')
 
+@inmain_decorator(wait_for_return=True)
+def _renderFrames(scene, n):
+    for i in range(n):
+        gui.clear()
+        scene.render(scene._global_rendering_parameters)
+
+def test_gl_object_leaks():
+    from ngsolve import x,y,z
+    name, mesh = meshes.meshes_3d[0]
+
+    settings = getParameters()
+    settings.individualClippingPlane = True
+    settings.setClippingNormal([0,0,1])
+
+    s = SolutionScene(z+x*x-0.3*y*y, mesh, iso_surface=x+2*y+z*z)
+    s._global_rendering_parameters = settings
+    Draw(s, name=name, tab=name+'_leaks')
+    s.setShowClippingPlane(True)
+    s.setShowIsoSurface(True)
+    s.setIsoValue(0.7)
+
+    # the first frame creates all needed objects, further frames must not create new ones
+    _renderFrames(s, 1)
+    counts = gl.getGLObjectCounts()
+    _renderFrames(s, 10)
+    assert gl.getGLObjectCounts() == counts
+
+def test_gl_state_cache():
+    from ngsolve import x,y
+    name, mesh = meshes.meshes_3d[0]
+    s = SolutionScene(x*y, mesh)
+    Draw(s, name=name, tab=name+'_state')
+
+    # rendering the element blocks sets the same program/textures/polygon mode several times
+    gl.gl_state.beginFrame()
+    _renderFrames(s, 1)
+    assert gl.gl_state.skipped > 0
+
+def test_profiler():
+    from ngsolve import x,y
+    from ngsgui.profiler import profiler
+    name, mesh = meshes.meshes_3d[0]
+    s = SolutionScene(x*y, mesh)
+    Draw(s, name=name, tab=name+'_profiler')
+
+    profiler.enabled = True
+    try:
+        profiler.reset()
+        for i in range(2):
+            profiler.beginFrame()
+            _renderFrames(s, 1)
+            profiler.endFrame()
+            GL.glFinish()
+        # reads the (finished) queries of both frames
+        profiler.beginFrame()
+        stats = profiler.getFrameStats()
+    finally:
+        profiler.enabled = False
+        profiler.reset()
+    assert len(stats) > 0
+    for path, times in stats.items():
+        assert times['frames'] == 2
+        for key in ('gpu', 'gpu_max', 'cpu', 'cpu_max'):
+            assert isinstance(times[key], float) and times[key] >= 0
+
+def test_gpu_timer():
+    from ngsolve import x,y
+    from ngsgui.profiler import GPUTimer
+    name, mesh = meshes.meshes_3d[0]
+    s = SolutionScene(x*y, mesh)
+    Draw(s, name=name, tab=name+'_timer')
+
+    timer = GPUTimer()
+    timer.begin()
+    _renderFrames(s, 1)
+    timer.end()
+    GL.glFinish()
+    time = timer.read()
+    assert isinstance(time, float) and time >= 0
+    # every measurement is read only once
+    assert timer.read() is None
+
 if __name__ == '__main__':
     for name,mesh in meshes.meshes_3d:
         #test_mesh(name, mesh)